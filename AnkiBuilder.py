@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import zipfile
+import tempfile
+import itertools
+from pathlib import Path
+import genanki
+
+
+class AnkiBuilder:
+    def __init__(self, out_file, model, manifest=None):
+        """
+        Incremental builder of an .apkg with several decks.
+
+        Every deck is registered with a fingerprint of its inputs, the notes
+        and media of a deck whose fingerprint is unchanged since the last run
+        are restored from the manifest so the caller can skip synthesizing and
+        encoding it. The package is only rewritten when a deck changed.
+
+        Media files are deduplicated by content hash, notes refer to the first
+        name seen for a content. Audio is already compressed, so media are
+        stored in the zip without deflating them again.
+
+        Args:
+            out_file: .apkg file to write
+            model: genanki.Model of all notes
+            manifest: json file of the deck/note/media fingerprints
+                (default: <out_file>.manifest.json)
+        """
+        self.out_file = Path(out_file)
+        self.model = model
+        self.manifest_path = Path(manifest or f"{self.out_file}.manifest.json")
+        self.manifest = self._load()
+        self.decks = {}  # deck_id -> {"name", "fingerprint", "notes", "media"}
+        self.changed = set()
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = {}
+        manifest.setdefault("decks", {})
+        manifest.setdefault("media", {})
+        return manifest
+
+    @staticmethod
+    def fingerprint(*args, **kwargs):
+        """sha256 of json serializable inputs, e.g. the words and settings of a deck."""
+        data = json.dumps([args, kwargs], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def is_fresh(self, deck_id, fingerprint):
+        """Whether the deck was built from the same inputs and its media still exist."""
+        entry = self.manifest["decks"].get(str(deck_id))
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return False
+        return all(Path(path).is_file() for path in entry["media"])
+
+    def add_deck(self, deck_id, name, fingerprint):
+        """
+        Register a deck, return False when it is restored from the manifest
+        and notes need not be added, True when it has to be built.
+        """
+        if self.is_fresh(deck_id, fingerprint):
+            entry = self.manifest["decks"][str(deck_id)]
+            self.decks[deck_id] = {**entry, "name": name}
+            return False
+        self.decks[deck_id] = {
+            "name": name,
+            "fingerprint": fingerprint,
+            "notes": [],
+            "media": [],
+        }
+        self.changed.add(deck_id)
+        return True
+
+    def add_note(self, deck_id, fields, tags=(), media=()):
+        """Add a note to a registered deck, `media` are the paths its fields refer to."""
+        deck = self.decks[deck_id]
+        deck["notes"].append(
+            {
+                # the guid stays stable when media are renamed by deduplication
+                "guid": genanki.guid_for(*fields),
+                "fields": list(fields),
+                "tags": list(tags),
+            }
+        )
+        deck["media"].extend(str(path) for path in media)
+
+    def _media_hash(self, path):
+        stat = os.stat(path)
+        key = str(Path(path).resolve())
+        entry = self.manifest["media"].get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        self.manifest["media"][key] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha.hexdigest(),
+        }
+        return sha.hexdigest()
+
+    def _dedupe_media(self):
+        """Return (paths to store, {name: canonical name}) deduplicated by content."""
+        by_hash = {}
+        renames = {}
+        paths = []
+        seen = set()
+        for deck in self.decks.values():
+            for path in deck["media"]:
+                if path in seen:
+                    continue
+                seen.add(path)
+                name = os.path.basename(path)
+                digest = self._media_hash(path)
+                if digest not in by_hash:
+                    by_hash[digest] = name
+                    paths.append(path)
+                elif by_hash[digest] != name:
+                    renames[name] = by_hash[digest]
+        return paths, renames
+
+    @staticmethod
+    def _rename_fields(fields, renames):
+        if not renames:
+            return fields
+        return [
+            re.sub(
+                r"\[sound:([^\]]+)\]",
+                lambda m: f"[sound:{renames.get(m.group(1), m.group(1))}]",
+                field,
+            )
+            for field in fields
+        ]
+
+    def write(self, force=False):
+        """
+        Write the package if a deck changed, was removed or the package is
+        missing. Return whether it was written.
+        """
+        removed = set(self.manifest["decks"]) - {str(i) for i in self.decks}
+        if not (force or self.changed or removed or not self.out_file.is_file()):
+            return False
+
+        paths, renames = self._dedupe_media()
+        decks = []
+        for deck_id, entry in self.decks.items():
+            deck = genanki.Deck(deck_id, entry["name"])
+            for note in entry["notes"]:
+                deck.add_note(
+                    genanki.Note(
+                        model=self.model,
+                        fields=self._rename_fields(note["fields"], renames),
+                        tags=note["tags"],
+                        guid=note["guid"],
+                    )
+                )
+            decks.append(deck)
+        self._write_package(genanki.Package(decks), paths)
+
+        self.manifest["decks"] = {
+            str(deck_id): {
+                "fingerprint": entry["fingerprint"],
+                "notes": entry["notes"],
+                "media": entry["media"],
+            }
+            for deck_id, entry in self.decks.items()
+        }
+        self._save()
+        self.changed.clear()
+        return True
+
+    def _write_package(self, package, media_paths):
+        """Same layout as genanki.Package.write_to_file, media are stored uncompressed."""
+        fd, db_file = tempfile.mkstemp(suffix=".anki2")
+        os.close(fd)
+        try:
+            conn = sqlite3.connect(db_file)
+            timestamp = time.time()
+            package.write_to_db(conn.cursor(), timestamp, itertools.count(int(timestamp * 1000)))
+            conn.commit()
+            conn.close()
+
+            temp = self.out_file.with_suffix(f".{os.getpid()}.tmp")
+            with zipfile.ZipFile(temp, "w", zipfile.ZIP_DEFLATED) as outzip:
+                outzip.write(db_file, "collection.anki2")
+                media = {str(idx): os.path.basename(path) for idx, path in enumerate(media_paths)}
+                outzip.writestr("media", json.dumps(media))
+                for idx, path in enumerate(media_paths):
+                    outzip.write(path, str(idx), compress_type=zipfile.ZIP_STORED)
+            os.replace(temp, self.out_file)
+        finally:
+            os.remove(db_file)
+
+    def _save(self):
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(temp, self.manifest_path)
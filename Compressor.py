@@ -1,23 +1,161 @@
 from pydub import AudioSegment
 from pathlib import Path
 import subprocess
+import time
+import wave
+import io
+from Metrics import METRICS
+from Tracer import TRACER
+
+# ffmpeg encoder backends, keyed by out_fmt.
+# "vbr" and "cbr" are the rate control arguments, formatted with the
+# compressor's bitrate and ffmpeg_q, "presets" are tuned for speech.
+ENCODERS = {
+    "mp3": {
+        "codec": "libmp3lame",
+        "format": "mp3",
+        "ext": "mp3",
+        # -q:a 0-9 where 0 is best quality (highest bitrate), 9 is worst (lowest)
+        # q:a 4 gives good quality speech at ~32-64kbps average
+        # q:a 5-6 gives smaller files (~16-32kbps) still good for speech
+        "vbr": ["-q:a", "{q}"],
+        "cbr": ["-b:a", "{bitrate}"],
+        "presets": {
+            "tiny": {"bitrate": "16k", "sample_rate": "16000", "q": "7"},
+            "small": {"bitrate": "24k", "sample_rate": "22050", "q": "5"},
+            "medium": {"bitrate": "32k", "sample_rate": "22050", "q": "4"},
+            "high": {"bitrate": "64k", "sample_rate": "44100", "q": "2"},
+        },
+    },
+    "opus": {
+        # opus only takes 8/12/16/24/48 kHz, 24 kHz is the engine's native rate
+        "codec": "libopus",
+        "format": "ogg",
+        "ext": "ogg",
+        "vbr": ["-b:a", "{bitrate}", "-vbr", "on", "-application", "voip"],
+        "cbr": ["-b:a", "{bitrate}", "-vbr", "off", "-application", "voip"],
+        "presets": {
+            "tiny": {"bitrate": "12k", "sample_rate": "16000", "q": None},
+            "small": {"bitrate": "16k", "sample_rate": "24000", "q": None},
+            "medium": {"bitrate": "24k", "sample_rate": "24000", "q": None},
+            "high": {"bitrate": "32k", "sample_rate": "48000", "q": None},
+        },
+    },
+    "aac": {
+        # raw adts stream, the mp4 muxer can not write to a pipe
+        "codec": "aac",
+        "format": "adts",
+        "ext": "aac",
+        # the native aac encoder's vbr mode is experimental, use the bitrate
+        "vbr": ["-b:a", "{bitrate}"],
+        "cbr": ["-b:a", "{bitrate}"],
+        "presets": {
+            "tiny": {"bitrate": "24k", "sample_rate": "16000", "q": None},
+            "small": {"bitrate": "32k", "sample_rate": "22050", "q": None},
+            "medium": {"bitrate": "48k", "sample_rate": "24000", "q": None},
+            "high": {"bitrate": "96k", "sample_rate": "44100", "q": None},
+        },
+    },
+}
+
+# ffmpeg raw input formats by sample width in bytes
+PCM_FORMATS = {1: "u8", 2: "s16le", 4: "s32le"}
+
+
+class PcmStream:
+    def __init__(self, cmd, sample_rate, channels=1, sample_width=2):
+        """
+        Raw pcm piped into a running ffmpeg process, frames are encoded as they
+        are written. Call `close()` (or use it as a context manager) to finish
+        the file.
+        """
+        self.sample_rate = int(sample_rate)
+        self.channels = int(channels)
+        self.sample_width = int(sample_width)
+        self.frames = 0
+        self.proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, frames):
+        self.proc.stdin.write(frames)
+        self.frames += len(frames) // (self.channels * self.sample_width)
+
+    def write_silence(self, seconds):
+        frames = int(round(seconds * self.sample_rate))
+        self.write(bytes(frames * self.channels * self.sample_width))
+
+    def write_wav(self, data, chunk_frames=4096):
+        """Append the frames of wav bytes, their format must match the stream's."""
+        with wave.open(io.BytesIO(data), "rb") as f:
+            params = (f.getframerate(), f.getnchannels(), f.getsampwidth())
+            if params != (self.sample_rate, self.channels, self.sample_width):
+                raise ValueError(
+                    f"wav format {params} does not match the stream "
+                    f"{(self.sample_rate, self.channels, self.sample_width)}"
+                )
+            while True:
+                frames = f.readframes(chunk_frames)
+                if not frames:
+                    break
+                self.write(frames)
+
+    @property
+    def duration(self):
+        return self.frames / self.sample_rate
+
+    def abort(self):
+        """Stop ffmpeg without finishing the file."""
+        self.proc.kill()
+        self.proc.wait()
+
+    def close(self):
+        _, stderr = self.proc.communicate()
+        if self.proc.returncode != 0:
+            raise subprocess.CalledProcessError(
+                self.proc.returncode, self.proc.args, stderr=stderr
+            )
 
 
 class Compressor:
-    def __init__(self, out_fmt="mp3", bitrate="32k", sample_rate="22050", channels=1):
+    def __init__(self, out_fmt="mp3", bitrate="32k", sample_rate="22050", channels=1, ffmpeg_q="5"):
         """
         Initialize audio compressor with optimized settings for small file size.
         
         Args:
-            out_fmt: Output format (default: mp3)
+            out_fmt: Output format, one of ENCODERS (mp3, opus, aac) is encoded
+                with ffmpeg, other formats with pydub (default: mp3)
             bitrate: Bitrate in kbps (default: 32k, lower = smaller file)
             sample_rate: Sample rate in Hz (default: 22050, speech-optimized)
             channels: Number of channels (default: 1 for mono, best for speech)
+            ffmpeg_q: VBR quality of mp3 (default: 5)
         """
         self.out_fmt = out_fmt
         self.bitrate = bitrate
         self.sample_rate = sample_rate
         self.channels = channels
+        self.ffmpeg_q = ffmpeg_q
+
+    @property
+    def encoder(self):
+        return ENCODERS.get(self.out_fmt)
+
+    @property
+    def ext(self):
+        """File extension of the output."""
+        return self.encoder["ext"] if self.encoder else self.out_fmt
 
     def compress(
         self,
@@ -28,45 +166,79 @@ class Compressor:
         use_ffmpeg_optimized=False,
     ):
         """
-        Compress audio file with optional ffmpeg optimization.
+        Compress audio file or wav bytes with optional VBR optimization.
+        Wav bytes are piped into ffmpeg, no temporary file is written.
         
         Args:
             data: Audio data in bytes
             in_file: Input audio file path
             out_file: Output audio file path
             overwrite: Whether to overwrite existing file
-            use_ffmpeg_optimized: Use ffmpeg with VBR for better compression (recommended)
+            use_ffmpeg_optimized: Use VBR for better compression (recommended)
         """
-        sound = None
         assert out_file, "out_file is not specified"
         out_file = Path(out_file)
         assert out_file.parent.exists(), f"{out_file.parent} is not found"
         
-        if isinstance(data, bytes):
-            sound = AudioSegment(data)
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            in_file = None
         elif isinstance(in_file, Path) or isinstance(in_file, str):
-            sound = AudioSegment.from_wav(in_file)
+            in_file = Path(in_file)
+            data = None
         else:
             raise ValueError("data or in_file is not valid")
         
         if out_file.is_dir() and in_file is not None:
-            out_file = out_file / f"{in_file.stem}.{self.out_fmt}"
+            out_file = out_file / f"{in_file.stem}.{self.ext}"
         
         if out_file.is_file() and not overwrite:
             return
         
-        # Use ffmpeg with VBR for better compression if available
-        if use_ffmpeg_optimized and self.out_fmt == "mp3":
+        start = time.perf_counter()
+        try:
+            with TRACER.span("compress", format=self.out_fmt):
+                self._compress(data, in_file, out_file, use_ffmpeg_optimized)
+        except Exception:
+            METRICS.inc("compress_errors_total", format=self.out_fmt)
+            raise
+        METRICS.observe("compress_seconds", time.perf_counter() - start, format=self.out_fmt)
+        METRICS.inc(
+            "compress_bytes_total",
+            len(data) if data is not None else in_file.stat().st_size,
+            format=self.out_fmt,
+            direction="in",
+        )
+        METRICS.inc(
+            "compress_bytes_total",
+            out_file.stat().st_size,
+            format=self.out_fmt,
+            direction="out",
+        )
+
+    def _compress(self, data, in_file, out_file, use_ffmpeg_optimized):
+        # Pipe through ffmpeg, with VBR for better compression if requested
+        if self.encoder:
             try:
-                self._compress_with_ffmpeg(sound, out_file)
+                self._compress_with_ffmpeg(
+                    data,
+                    in_file,
+                    out_file,
+                    use_ffmpeg_optimized,
+                    resample=not self.matches_profile(data, in_file),
+                )
                 return
             except Exception as e:
                 print(f"FFmpeg compression failed, falling back to pydub: {e}")
         
         # Fallback to pydub compression
+        if data is not None:
+            sound = AudioSegment.from_file(io.BytesIO(data), format="wav")
+        else:
+            sound = AudioSegment.from_wav(in_file)
         sound.export(
             out_file, 
-            format=self.out_fmt, 
+            format=self.encoder["format"] if self.encoder else self.out_fmt,
+            codec=self.encoder["codec"] if self.encoder else None,
             bitrate=self.bitrate,
             parameters=[
                 "-ar", str(self.sample_rate),  # Sample rate
@@ -74,56 +246,132 @@ class Compressor:
             ]
         )
     
-    def _compress_with_ffmpeg(self, sound, out_file):
+    def output_profile(self):
         """
-        Use ffmpeg with VBR (Variable Bit Rate) for optimal compression.
-        This produces much smaller files while maintaining good quality for speech.
+        Query fields making the engine render at this compressor's sample
+        rate and channel count, so the encoder does not have to resample.
         """
-        # Create a temporary wav file
-        temp_wav = out_file.with_suffix(".tmp.wav")
-        sound.export(temp_wav, format="wav")
-        
-        # FFmpeg command with VBR for MP3
-        # -q:a 0-9 where 0 is best quality (highest bitrate), 9 is worst (lowest)
-        # q:a 4 gives good quality speech at ~32-64kbps average
-        # q:a 5-6 gives smaller files (~16-32kbps) still good for speech
-        ffmpeg_cmd = [
+        return {
+            "outputSamplingRate": int(self.sample_rate),
+            "outputStereo": int(self.channels) > 1,
+        }
+
+    def matches_profile(self, data=None, in_file=None):
+        """Whether the wav input already has the output sample rate and channels."""
+        try:
+            if data is not None:
+                # the header is enough, the chunk sizes are not checked
+                f = wave.open(io.BytesIO(bytes(data[:4096])), "rb")
+            else:
+                f = wave.open(str(in_file), "rb")
+            with f:
+                return f.getframerate() == int(self.sample_rate) and f.getnchannels() == int(
+                    self.channels
+                )
+        except (wave.Error, EOFError, OSError):
+            return False
+
+    def _ffmpeg_cmd(self, in_file, output, vbr=True, resample=True, pcm=None):
+        """
+        FFmpeg command encoding with the out_fmt's backend, with VBR (Variable
+        Bit Rate) for optimal compression or with the constant bitrate. Reads
+        wav from stdin when in_file is None, or raw pcm when `pcm` is
+        (sample_rate, channels, sample_width). Without `resample` the input's
+        rate and channels are kept.
+        """
+        if pcm is not None:
+            rate, channels, width = pcm
+            input_args = [
+                "-f", PCM_FORMATS[width], "-ar", str(rate), "-ac", str(channels),
+                "-i", "pipe:0",
+            ]
+        elif in_file is None:
+            input_args = ["-f", "wav", "-i", "pipe:0"]
+        else:
+            input_args = ["-i", str(in_file)]
+        encoder = self.encoder
+        rate_control = [
+            arg.format(q=self.ffmpeg_q, bitrate=self.bitrate)
+            for arg in encoder["vbr" if vbr else "cbr"]
+        ]
+        return [
             "ffmpeg", "-y",
-            "-i", str(temp_wav),
+            "-hide_banner", "-loglevel", "error",
+            *input_args,
             "-vn",  # No video
-            "-acodec", "libmp3lame",  # MP3 codec
-            "-q:a", "5",  # VBR quality level (4-6 recommended for speech)
-            "-ar", str(self.sample_rate),  # Sample rate
-            "-ac", str(self.channels),  # Mono channel
-            str(out_file)
+            "-acodec", encoder["codec"],
+            *rate_control,
+            *(
+                ["-ar", str(self.sample_rate), "-ac", str(self.channels)]  # Sample rate, mono
+                if resample
+                else []
+            ),
+            "-f", encoder["format"],
+            str(output),
         ]
-        
-        try:
-            subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
-        finally:
-            # Clean up temp file
-            if temp_wav.exists():
-                temp_wav.unlink()
+
+    def _compress_with_ffmpeg(self, data, in_file, out_file, vbr=True, resample=True):
+        """
+        Encode wav bytes (piped through stdin) or a wav file straight into
+        out_file, no intermediate wav is written.
+        """
+        subprocess.run(
+            self._ffmpeg_cmd(in_file, out_file, vbr, resample),
+            input=data,
+            check=True,
+            capture_output=True,
+        )
+
+    def encode(self, data, vbr=True):
+        """
+        Encode wav bytes to out_fmt bytes in memory, streamed through ffmpeg's
+        stdin and stdout.
+        """
+        result = subprocess.run(
+            self._ffmpeg_cmd(None, "pipe:1", vbr, resample=not self.matches_profile(data)),
+            input=data,
+            check=True,
+            capture_output=True,
+        )
+        return result.stdout
+
+    def open_stream(self, out_file, sample_rate, channels=1, sample_width=2, vbr=True):
+        """
+        Start encoding raw pcm into out_file, see PcmStream. Nothing but the
+        pipe buffer is held in memory however long the stream is.
+        """
+        resample = int(sample_rate) != int(self.sample_rate) or int(channels) != int(
+            self.channels
+        )
+        return PcmStream(
+            self._ffmpeg_cmd(
+                None,
+                out_file,
+                vbr,
+                resample,
+                pcm=(sample_rate, channels, sample_width),
+            ),
+            sample_rate,
+            channels,
+            sample_width,
+        )
     
     def set_quality(self, quality="small"):
         """
-        Set predefined quality presets.
+        Set predefined quality presets of the out_fmt's backend.
         
         Args:
-            quality: 'tiny' (16k), 'small' (24k), 'medium' (32k), 'high' (64k)
+            quality: 'tiny', 'small', 'medium', 'high', for mp3 16k, 24k, 32k,
+                64k, for opus 12k, 16k, 24k, 32k, for aac 24k, 32k, 48k, 96k
         """
-        presets = {
-            "tiny": {"bitrate": "16k", "sample_rate": "16000", "q": "7"},
-            "small": {"bitrate": "24k", "sample_rate": "22050", "q": "5"},
-            "medium": {"bitrate": "32k", "sample_rate": "22050", "q": "4"},
-            "high": {"bitrate": "64k", "sample_rate": "44100", "q": "2"},
-        }
+        presets = (self.encoder or ENCODERS["mp3"])["presets"]
         
         if quality in presets:
             preset = presets[quality]
             self.bitrate = preset["bitrate"]
             self.sample_rate = preset["sample_rate"]
-            self.ffmpeg_q = preset["q"]
+            if preset["q"] is not None:
+                self.ffmpeg_q = preset["q"]
         else:
             raise ValueError(f"Unknown quality preset: {quality}")
 
@@ -135,11 +383,13 @@ if __name__ == "__main__":
     
     test_file = "output.wav"
     if Path(test_file).exists():
-        for quality in ["tiny", "small", "medium", "high"]:
-            c.set_quality(quality)
-            output_file = f"output_{quality}.mp3"
-            c.compress(test_file, output_file, use_ffmpeg_optimized=True)
-            size = Path(output_file).stat().st_size / 1024  # KB
-            print(f"{quality}: {size:.1f} KB")
+        for out_fmt in ENCODERS:
+            c.out_fmt = out_fmt
+            for quality in ["tiny", "small", "medium", "high"]:
+                c.set_quality(quality)
+                output_file = f"output_{quality}.{c.ext}"
+                c.compress(in_file=test_file, out_file=output_file, use_ffmpeg_optimized=True)
+                size = Path(output_file).stat().st_size / 1024  # KB
+                print(f"{out_fmt} {quality}: {size:.1f} KB")
     else:
-        c.compress("output.wav", "output.mp3")
+        c.compress(in_file="output.wav", out_file="output.mp3")
@@ -0,0 +1,135 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, Future
+from multiprocessing import shared_memory, resource_tracker
+from Compressor import Compressor
+from Metrics import METRICS
+from Tracer import TRACER
+
+_COMPRESSOR = None
+
+
+def _init_worker(compressor, trace=False):
+    global _COMPRESSOR
+    _COMPRESSOR = compressor
+    # a forked worker inherits what the parent recorded so far, drop it or
+    # the parent merges it a second time
+    METRICS.drain()
+    TRACER.drain()
+    TRACER.enable(trace)
+
+
+def _compress(shm_name, size, in_file, out_file, overwrite, use_ffmpeg_optimized, tags):
+    shm = view = None
+    if shm_name is not None:
+        # workers share the parent's resource tracker, the parent unlinks the block
+        shm = shared_memory.SharedMemory(name=shm_name)
+        view = shm.buf[:size]
+    try:
+        with TRACER.tags(**tags):
+            _COMPRESSOR.compress(
+                data=view,
+                in_file=in_file,
+                out_file=out_file,
+                overwrite=overwrite,
+                use_ffmpeg_optimized=use_ffmpeg_optimized,
+            )
+    finally:
+        if shm is not None:
+            view.release()
+            shm.close()
+    # metrics and spans recorded in this process are merged by the parent
+    return str(out_file), METRICS.drain(), TRACER.drain()
+
+
+class CompressorPool:
+    def __init__(self, compressor=None, workers=None, max_pending=None):
+        """
+        Run Compressor.compress in a process pool so encoding overlaps with
+        synthesis.
+
+        Wav bytes are handed to the workers through shared memory instead of
+        being pickled, `submit` returns a Future which raises the worker's
+        exception from `result()`. At most `max_pending` jobs are queued,
+        `submit` blocks beyond that to bound memory. Metrics and spans recorded
+        in the workers are merged into this process' METRICS and TRACER, spans
+        keep the tracer tags of the submitting thread.
+
+        Args:
+            compressor: Compressor whose settings the workers use
+            workers: number of worker processes (default: cpu count)
+            max_pending: max number of submitted but unfinished jobs
+                (default: 4 * workers)
+        """
+        self.compressor = compressor or Compressor()
+        self.workers = workers or os.cpu_count() or 1
+        self.pending = threading.BoundedSemaphore(max_pending or 4 * self.workers)
+        # workers must inherit this process' tracker, otherwise each of them
+        # starts its own and reports the blocks unlinked here as leaked
+        resource_tracker.ensure_running()
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.compressor, TRACER.enabled),
+        )
+        # start the workers now, forking later from a synthesis thread could
+        # copy locks held by other threads into the workers
+        self.executor.submit(int).result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def submit(
+        self,
+        data=None,
+        in_file=None,
+        out_file=None,
+        overwrite=False,
+        use_ffmpeg_optimized=False,
+    ):
+        shm = None
+        self.pending.acquire()
+        try:
+            if data is not None:
+                shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+                shm.buf[: len(data)] = data
+            inner = self.executor.submit(
+                _compress,
+                shm.name if shm else None,
+                len(data) if shm else 0,
+                in_file,
+                out_file,
+                overwrite,
+                use_ffmpeg_optimized,
+                TRACER.current_tags(),
+            )
+        except BaseException:
+            self._release(shm)
+            raise
+        future = Future()
+        future.set_running_or_notify_cancel()
+        inner.add_done_callback(lambda inner: self._done(inner, future, shm))
+        return future
+
+    def _done(self, inner, future, shm):
+        self._release(shm)
+        error = inner.exception()
+        if error is not None:
+            future.set_exception(error)
+            return
+        out_file, metrics, spans = inner.result()
+        METRICS.merge(metrics)
+        TRACER.merge(spans)
+        future.set_result(out_file)
+
+    def _release(self, shm):
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        self.pending.release()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,354 @@
+import time
+import logging
+import threading
+import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait, FIRST_COMPLETED
+from VoicevoxEngine import VoicevoxEngine, VoicevoxEngineError
+
+# pool methods without side effects, a duplicate request is harmless
+HEDGEABLE_METHODS = {"audio_query", "make_query", "synthesis", "synthesis_batch"}
+
+
+class EngineNode:
+    def __init__(self, engine):
+        self.engine = engine
+        self.in_flight = 0
+        self.healthy = True
+        self.failed_at = 0.0
+        self.failures = 0
+        self.requests = 0
+
+    def to_dict(self):
+        return {
+            "base_url": self.engine.base_url,
+            "in_flight": self.in_flight,
+            "healthy": self.healthy,
+            "failures": self.failures,
+            "requests": self.requests,
+        }
+
+    def __str__(self):
+        return str(self.to_dict())
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class EnginePool:
+    def __init__(
+        self,
+        base_urls: list,
+        device: str = "cuda",
+        cache=None,
+        query_store=None,
+        retry_after: float = 30.0,
+        sticky_slack: int = 2,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+        **engine_kwargs,
+    ):
+        """
+        Spread requests over several Voicevox Engine processes.
+
+        Every request goes to the least loaded healthy node, a speaker sticks
+        to the node it was last routed to as long as that node is at most
+        `sticky_slack` requests busier than the least loaded one, so style
+        models are not loaded on every node. A node raising a connection error
+        is taken out of rotation and tried again after `retry_after` seconds.
+
+        With `hedge`, an idempotent request still running after the
+        `hedge_quantile` latency of its method is duplicated on another node
+        and the first response wins.
+
+        Args:
+            base_urls: base urls of the engines, they must serve the same speakers
+            device: device the engines should run on
+            cache: optional SynthesisCache shared by all nodes
+            query_store: optional QueryStore shared by all nodes
+            retry_after: seconds before a failed node is tried again
+            sticky_slack: extra in-flight requests tolerated to keep a speaker sticky
+            hedge: send hedged requests for tail latency
+            hedge_quantile: latency quantile after which a request is hedged
+            hedge_min_samples: latency samples of a method needed before hedging
+            engine_kwargs: passed to every VoicevoxEngine, e.g. timeouts, max_retries
+        """
+        assert base_urls, Exception("at least one base_url is required")
+        self.nodes = [
+            EngineNode(
+                VoicevoxEngine(
+                    base_url=base_url,
+                    device=device,
+                    cache=cache,
+                    query_store=query_store,
+                    **engine_kwargs,
+                )
+            )
+            for base_url in base_urls
+        ]
+        self.cache = cache
+        self.query_store = query_store
+        self.retry_after = retry_after
+        self.sticky_slack = sticky_slack
+        self.hedge = hedge and len(self.nodes) > 1
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = {}
+        self.call_stats = {}
+        self.executor = ThreadPoolExecutor(max_workers=16 * len(self.nodes)) if self.hedge else None
+        self.sticky = {}
+        self.lock = threading.Lock()
+        self.check_speakers()
+
+    @property
+    def base_url(self):
+        return self.nodes[0].engine.base_url
+
+    @property
+    def speakers(self):
+        return self.nodes[0].engine.speakers
+
+    @property
+    def output_profile(self):
+        return self.nodes[0].engine.output_profile
+
+    @output_profile.setter
+    def output_profile(self, output_profile):
+        for node in self.nodes:
+            node.engine.output_profile = output_profile or {}
+
+    @property
+    def catalog(self):
+        return self.nodes[0].engine.catalog
+
+    @property
+    def version(self):
+        return self.nodes[0].engine.version
+
+    @staticmethod
+    def _style_ids(engine):
+        return sorted(engine.catalog.by_style_id)
+
+    def check_speakers(self):
+        expected = self._style_ids(self.nodes[0].engine)
+        for node in self.nodes[1:]:
+            style_ids = self._style_ids(node.engine)
+            if style_ids != expected:
+                raise Exception(
+                    f"{node.engine.base_url} serves different speakers than "
+                    f"{self.nodes[0].engine.base_url}: "
+                    f"{sorted(set(style_ids) ^ set(expected))}"
+                )
+
+    def refresh_speaker(self):
+        for node in self.nodes:
+            node.engine.refresh_speaker()
+        self.check_speakers()
+        return self.speakers
+
+    def _available(self, exclude):
+        now = time.monotonic()
+        nodes = [
+            node
+            for node in self.nodes
+            if node not in exclude
+            and (node.healthy or now - node.failed_at >= self.retry_after)
+        ]
+        if not nodes:
+            raise Exception("no healthy Voicevox Engine available")
+        return nodes
+
+    def acquire(self, speaker=None, exclude=()):
+        with self.lock:
+            nodes = self._available(exclude)
+            node = min(nodes, key=lambda n: n.in_flight)
+            sticky = self.sticky.get(speaker)
+            if sticky in nodes and sticky.in_flight <= node.in_flight + self.sticky_slack:
+                node = sticky
+            if speaker is not None:
+                self.sticky[speaker] = node
+            node.in_flight += 1
+            node.requests += 1
+            return node
+
+    def release(self, node, error=None):
+        with self.lock:
+            node.in_flight -= 1
+            if error is None:
+                node.healthy = True
+                return
+            node.healthy = False
+            node.failed_at = time.monotonic()
+            node.failures += 1
+            for speaker in [k for k, v in self.sticky.items() if v is node]:
+                del self.sticky[speaker]
+
+    @staticmethod
+    def is_node_failure(error):
+        if isinstance(error, requests.exceptions.RequestException):
+            return True
+        return isinstance(error, VoicevoxEngineError) and (error.status_code or 0) >= 500
+
+    def _count(self, method, key):
+        stats = self.call_stats.setdefault(method, {"calls": 0, "hedges": 0, "hedge_wins": 0})
+        stats[key] += 1
+
+    def hedge_delay(self, method):
+        with self.lock:
+            samples = sorted(self.latencies.get(method, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_quantile))]
+
+    def _run(self, node, method, args, kwargs):
+        start = time.monotonic()
+        try:
+            result = getattr(node.engine, method)(*args, **kwargs)
+        except Exception as e:
+            self.release(node, e if self.is_node_failure(e) else None)
+            raise
+        self.release(node)
+        with self.lock:
+            self.latencies.setdefault(method, deque(maxlen=500)).append(
+                time.monotonic() - start
+            )
+        return result
+
+    def call(self, method, *args, route=None, **kwargs):
+        """
+        Run `engine.<method>` on a node, failing over to the others on
+        connection errors. `route` is the speaker used for sticky routing.
+        """
+        with self.lock:
+            self._count(method, "calls")
+        if self.hedge and method in HEDGEABLE_METHODS:
+            return self._hedged_call(method, args, kwargs, route)
+        tried = []
+        while True:
+            node = self.acquire(route, exclude=tried)
+            try:
+                return self._run(node, method, args, kwargs)
+            except Exception as e:
+                tried.append(node)
+                if not self.is_node_failure(e) or len(tried) >= len(self.nodes):
+                    raise
+
+    def _hedged_call(self, method, args, kwargs, route):
+        tried = []
+        while True:
+            node = self.acquire(route, exclude=tried)
+            primary = self.executor.submit(self._run, node, method, args, kwargs)
+            try:
+                return primary.result(timeout=self.hedge_delay(method))
+            except TimeoutError:
+                break
+            except Exception as e:
+                # fail over here, going through call() again would count it twice
+                tried.append(node)
+                if not self.is_node_failure(e) or len(tried) >= len(self.nodes):
+                    raise
+
+        try:
+            backup_node = self.acquire(None, exclude=tried + [node])
+        except Exception:
+            return primary.result()
+        with self.lock:
+            self._count(method, "hedges")
+        backup = self.executor.submit(self._run, backup_node, method, args, kwargs)
+        done, _ = wait([primary, backup], return_when=FIRST_COMPLETED)
+        first = done.pop()
+        if first.exception() is not None:
+            first = backup if first is primary else primary
+        if first is backup and backup.exception() is None:
+            with self.lock:
+                self._count(method, "hedge_wins")
+        return first.result()
+
+    def audio_query(self, speaker: int, text: str):
+        return self.call("audio_query", speaker, text, route=speaker)
+
+    def make_query(self, speaker, text, params_hook: dict = {}):
+        return self.call("make_query", speaker, text, params_hook, route=speaker)
+
+    def synthesis(self, speaker: int, params: dict, enable_interrogative_upspeak=True):
+        return self.call(
+            "synthesis",
+            speaker,
+            params,
+            enable_interrogative_upspeak,
+            route=speaker,
+        )
+
+    def synthesis_batch(self, speaker: int, queries: list, max_items=None, max_moras=None):
+        return self.call(
+            "synthesis_batch",
+            speaker,
+            queries,
+            max_items,
+            max_moras,
+            route=speaker,
+        )
+
+    def speaker_init(self, **kwargs):
+        """
+        Warm the speaker on every available node, so it is not loaded cold
+        wherever its requests are routed later. Nodes failing are logged and
+        skipped, it raises only when no node could be initialized.
+        """
+        with self.lock:
+            self._count("speaker_init", "calls")
+            nodes = self._available(())
+            for node in nodes:
+                node.in_flight += 1
+                node.requests += 1
+        error = None
+        warmed = 0
+        for node in nodes:
+            try:
+                self._run(node, "speaker_init", (), kwargs)
+                warmed += 1
+            except Exception as e:
+                error = e
+                logging.getLogger(__name__).warning(
+                    f"speaker_init of {kwargs.get('speaker')} failed on {node.engine.base_url}: {e}"
+                )
+        if not warmed:
+            raise error
+        return True
+
+    def tts(self, speaker, text, params_hook: dict = {}, output=None, overwrite=False):
+        if self.hedge:
+            # run the steps of VoicevoxEngine.tts on the pool, so make_query
+            # and synthesis are hedged one by one
+            return VoicevoxEngine.tts(self, speaker, text, params_hook, output, overwrite)
+        return self.call(
+            "tts",
+            speaker,
+            text,
+            params_hook,
+            output,
+            overwrite,
+            route=speaker,
+        )
+
+    def tts_batch(self, speaker, texts, params_hook: dict = {}):
+        if self.hedge:
+            return VoicevoxEngine.tts_batch(self, speaker, texts, params_hook)
+        return self.call("tts_batch", speaker, texts, params_hook, route=speaker)
+
+    def cache_key(self, speaker, text, params_hook: dict = {}):
+        return self.nodes[0].engine.cache_key(speaker, text, params_hook)
+
+    def get_speaker_style(self, *args, **kwargs):
+        return self.nodes[0].engine.get_speaker_style(*args, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "nodes": [
+                    {**node.to_dict(), "endpoints": node.engine.stats()}
+                    for node in self.nodes
+                ],
+                "calls": {k: dict(v) for k, v in self.call_stats.items()},
+            }
@@ -0,0 +1,247 @@
+import io
+import re
+import wave
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from Metrics import METRICS
+from Tracer import TRACER
+
+# seconds of silence inserted after a chunk ending with the punctuation, at
+# speedScale 1.0
+PAUSES = {
+    "、": 0.25,
+    "，": 0.25,
+    ",": 0.25,
+    "。": 0.5,
+    "．": 0.5,
+    "！": 0.5,
+    "？": 0.5,
+    "!": 0.5,
+    "?": 0.5,
+    "\n": 0.5,
+}
+_SENTENCE_END = "。．！？!?\n"
+_CLAUSE_END = "、，,"
+# small kana are spoken together with the kana before them
+_SMALL_KANA = set("ゃゅょぁぃぅぇぉゎャュョァィゥェォヮ")
+
+
+def estimate_moras(text):
+    """
+    Rough mora count of a text before it is sent to /audio_query: one per
+    kana (small kana excluded), two per kanji or digit, one per latin letter.
+    """
+    moras = 0
+    for c in text:
+        if c in _SMALL_KANA:
+            continue
+        if "぀" <= c <= "ヿ":
+            moras += 1
+        elif "一" <= c <= "鿿" or c.isdigit():
+            moras += 2
+        elif c.isalpha():
+            moras += 1
+    return moras
+
+
+def _split_at(text, marks):
+    """Split after every run of `marks`, the marks stay with the text before them."""
+    return [part for part in re.findall(rf"[^{marks}]+[{marks}]*|[{marks}]+", text) if part.strip()]
+
+
+def split_text(text, max_moras=80):
+    """
+    Split text into chunks of at most `max_moras` estimated moras, at sentence
+    ends (。！？) first and at clauses (、) for longer sentences. A clause still
+    over the budget is cut by characters. Neighbouring pieces are packed into
+    one chunk as long as it stays within the budget, so the engine renders
+    the pauses inside a chunk itself.
+    """
+    pieces = []
+    for sentence in _split_at(text, re.escape(_SENTENCE_END)):
+        if estimate_moras(sentence) <= max_moras:
+            pieces.append(sentence)
+            continue
+        for clause in _split_at(sentence, re.escape(_CLAUSE_END)):
+            while estimate_moras(clause) > max_moras:
+                # no punctuation left, cut the clause at the budget
+                end = 1
+                while estimate_moras(clause[: end + 1]) <= max_moras:
+                    end += 1
+                pieces.append(clause[:end])
+                clause = clause[end:]
+            pieces.append(clause)
+
+    chunks = []
+    for piece in pieces:
+        if chunks and (
+            estimate_moras(chunks[-1] + piece) <= max_moras or not estimate_moras(piece)
+        ):
+            chunks[-1] += piece
+        else:
+            chunks.append(piece)
+    return [chunk.strip() for chunk in chunks if chunk.strip()] or [text]
+
+
+def pause_after(chunk, speed_scale=1.0, pause_length_scale=1.0):
+    """Seconds of silence after a chunk, by its last punctuation mark."""
+    chunk = chunk.rstrip(" 　")
+    seconds = PAUSES.get(chunk[-1], 0.0) if chunk else 0.0
+    return seconds * pause_length_scale / (speed_scale or 1.0)
+
+
+def join_wavs(wavs, pauses):
+    """
+    Concatenate wav bytes of the same format frame by frame with `pauses[i]`
+    seconds of silence after `wavs[i]`, return the wav bytes.
+    """
+    out = io.BytesIO()
+    params = None
+    with wave.open(out, "wb") as w:
+        for data, pause in zip(wavs, pauses):
+            with wave.open(io.BytesIO(data), "rb") as r:
+                current = (r.getnchannels(), r.getsampwidth(), r.getframerate())
+                if params is None:
+                    params = current
+                    w.setnchannels(params[0])
+                    w.setsampwidth(params[1])
+                    w.setframerate(params[2])
+                elif current != params:
+                    raise Exception(f"chunks differ in format: {current} != {params}")
+                w.writeframes(r.readframes(r.getnframes()))
+            frames = round(pause * params[2])
+            if frames:
+                # 8 bit wav is unsigned, its silence is 0x80
+                silence = b"\x80" if params[1] == 1 else b"\x00"
+                w.writeframes(silence * (frames * params[0] * params[1]))
+    return out.getvalue()
+
+
+class ChunkedQuery:
+    def __init__(self, chunks, queries):
+        """The audio queries of the chunks of one long text, see LongTextEngine.make_query."""
+        self.chunks = chunks
+        self.queries = queries
+        self.pauses = [
+            pause_after(chunk, query.get("speedScale", 1.0), query.get("pauseLengthScale", 1.0))
+            for chunk, query in zip(chunks, queries)
+        ]
+        self.pauses[-1] = 0.0
+
+    def __len__(self):
+        return len(self.chunks)
+
+
+class LongTextEngine:
+    def __init__(self, engine, max_moras=80, workers=4):
+        """
+        Wrap a VoicevoxEngine or EnginePool to synthesize long texts in chunks.
+
+        Texts over `max_moras` estimated moras are split at sentence and clause
+        punctuation (see split_text), the chunks are queried and synthesized
+        concurrently by `workers` threads, with an EnginePool they are spread
+        over the engines. Inner chunk borders get no pre/post phoneme silence,
+        a pause depending on the punctuation is inserted instead and the
+        frames are concatenated into one wav without resampling.
+
+        Short texts and everything else are passed to the wrapped engine, so
+        the wrapper can stand in for the engine in TtsPipeline and
+        iter_batched_jobs.
+
+        Args:
+            engine: VoicevoxEngine or EnginePool
+            max_moras: mora budget of a chunk
+            workers: chunks synthesized at the same time
+        """
+        self.engine = engine
+        self.max_moras = max_moras
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk")
+
+    def __getattr__(self, name):
+        if name == "engine":
+            raise AttributeError(name)
+        return getattr(self.engine, name)
+
+    def split(self, text):
+        if estimate_moras(text) <= self.max_moras:
+            return [text]
+        return split_text(text, self.max_moras)
+
+    def _map(self, func, items):
+        # chunk spans keep the tracer tags of the calling thread
+        tags = TRACER.current_tags()
+
+        def run(args):
+            idx, item = args
+            with TRACER.tags(**tags, chunk=idx):
+                return func(idx, item)
+
+        return list(self.executor.map(run, enumerate(items)))
+
+    def cache_key(self, speaker, text, params_hook: dict = {}):
+        chunks = self.split(text)
+        if len(chunks) > 1:
+            # the joined wav depends on the chunking
+            params_hook = {**params_hook, "long_text": [self.max_moras, PAUSES]}
+        return self.engine.cache_key(speaker, text, params_hook)
+
+    def make_query(self, speaker, text, params_hook: dict = {}):
+        """Like engine.make_query, a ChunkedQuery for texts over the mora budget."""
+        chunks = self.split(text)
+        if len(chunks) == 1:
+            return self.engine.make_query(speaker, text, params_hook)
+
+        def query(idx, chunk):
+            hook = dict(params_hook)
+            if idx > 0:
+                hook["prePhonemeLength"] = 0.0
+            if idx < len(chunks) - 1:
+                hook["postPhonemeLength"] = 0.0
+            return self.engine.make_query(speaker, chunk, hook)
+
+        return ChunkedQuery(chunks, self._map(query, chunks))
+
+    def synthesis(self, speaker: int, params, enable_interrogative_upspeak=True):
+        if not isinstance(params, ChunkedQuery):
+            return self.engine.synthesis(speaker, params, enable_interrogative_upspeak)
+        wavs = self._map(
+            lambda idx, query: self.engine.synthesis(speaker, query, enable_interrogative_upspeak),
+            params.queries,
+        )
+        return join_wavs(wavs, params.pauses)
+
+    def tts(self, speaker, text, params_hook: dict = {}, output=None, overwrite=False):
+        if len(self.split(text)) == 1:
+            return self.engine.tts(speaker, text, params_hook, output, overwrite)
+        cache = getattr(self.engine, "cache", None)
+        cache_key = self.cache_key(speaker, text, params_hook) if cache is not None else None
+        wav = cache.get(cache_key) if cache_key is not None else None
+        if wav is None:
+            wav = self.synthesis(speaker, self.make_query(speaker, text, params_hook))
+            if cache_key is not None:
+                cache.put(cache_key, wav)
+        if output:
+            output = Path(output)
+            if not output.is_file() or overwrite:
+                with METRICS.time("file_write_seconds", format="wav"), TRACER.span("file_write", format="wav"):
+                    with open(output, "wb") as f:
+                        f.write(wav)
+            return
+        return wav
+
+    def tts_batch(self, speaker, texts, params_hook: dict = {}):
+        """Short texts go through engine.tts_batch, long ones are chunked."""
+        wavs = [None] * len(texts)
+        short = [idx for idx, text in enumerate(texts) if len(self.split(text)) == 1]
+        if short:
+            batch = self.engine.tts_batch(speaker, [texts[idx] for idx in short], params_hook)
+            for idx, wav in zip(short, batch):
+                wavs[idx] = wav
+        for idx, text in enumerate(texts):
+            if wavs[idx] is None:
+                wavs[idx] = self.tts(speaker, text, params_hook)
+        return wavs
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# latency buckets in seconds, from a cache hit to a long synthesis
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "voicevox_request_seconds": "latency of Voicevox Engine requests",
+    "voicevox_request_bytes_total": "bytes sent to and received from the engine",
+    "voicevox_request_errors_total": "failed engine requests",
+    "voicevox_tts_seconds": "latency of VoicevoxEngine.tts including cache lookups",
+    "compress_seconds": "latency of Compressor.compress",
+    "compress_bytes_total": "bytes read and written by Compressor.compress",
+    "compress_errors_total": "failed compressions",
+    "file_write_seconds": "latency of writing audio files",
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items() if v is not None))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Progress:
+    def __init__(self, window=60.0):
+        """Items done, their rate over the last `window` seconds and the ETA."""
+        self.window = window
+        self.total = None
+        self.done = 0
+        self.started = time.monotonic()
+        self.samples = deque()
+
+    def add(self, n=1):
+        now = time.monotonic()
+        self.done += n
+        self.samples.append((now, self.done))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+    def rate(self):
+        if len(self.samples) < 2:
+            elapsed = time.monotonic() - self.started
+            return self.done / elapsed if elapsed > 0 else 0.0
+        (t0, d0), (t1, d1) = self.samples[0], self.samples[-1]
+        return (d1 - d0) / (t1 - t0) if t1 > t0 else 0.0
+
+    def to_dict(self):
+        rate = self.rate()
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = max(0, self.total - self.done) / rate
+        return {
+            "done": self.done,
+            "total": self.total,
+            "items_per_sec": rate,
+            "eta_seconds": eta,
+            "elapsed_seconds": time.monotonic() - self.started,
+        }
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        In-process registry of latency histograms and counters labelled by
+        endpoint, speaker, format, ...
+
+        It is exposed as prometheus text by `serve()` or as json snapshots by
+        `start_snapshots()`. Worker processes `drain()` what they recorded and
+        the parent `merge()`s it, see CompressorPool.
+        """
+        self.buckets = tuple(buckets)
+        self.histograms = {}  # name -> labels key -> [bucket counts..., count, sum]
+        self.counters = {}  # name -> labels key -> value
+        self.progress = Progress()
+        self.lock = threading.Lock()
+        self.server = None
+        self.snapshot_thread = None
+        self.stop_event = threading.Event()
+
+    def observe(self, name, value, **labels):
+        key = _labels_key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            data = series.get(key)
+            if data is None:
+                data = series[key] = [0] * (len(self.buckets) + 2)
+            if idx < len(self.buckets):
+                data[idx] += 1
+            data[-2] += 1
+            data[-1] += value
+
+    def inc(self, name, value=1, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def time(self, name, **labels):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, name, labels)
+
+    def set_total(self, total):
+        with self.lock:
+            self.progress.total = total
+
+    def item_done(self, n=1):
+        with self.lock:
+            self.progress.add(n)
+
+    def drain(self):
+        """Return and reset the recorded series, e.g. to ship them out of a worker process."""
+        with self.lock:
+            data = {
+                "histograms": {
+                    name: [[list(k), v] for k, v in series.items()]
+                    for name, series in self.histograms.items()
+                },
+                "counters": {
+                    name: [[list(k), v] for k, v in series.items()]
+                    for name, series in self.counters.items()
+                },
+            }
+            self.histograms = {}
+            self.counters = {}
+        return data
+
+    def merge(self, data):
+        with self.lock:
+            for name, series in data["histograms"].items():
+                target = self.histograms.setdefault(name, {})
+                for key, values in series:
+                    key = tuple(tuple(item) for item in key)
+                    if key in target:
+                        target[key] = [a + b for a, b in zip(target[key], values)]
+                    else:
+                        target[key] = list(values)
+            for name, series in data["counters"].items():
+                target = self.counters.setdefault(name, {})
+                for key, value in series:
+                    key = tuple(tuple(item) for item in key)
+                    target[key] = target.get(key, 0) + value
+
+    @staticmethod
+    def _quantile(buckets, data, q):
+        count = data[-2]
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for bound, n in zip(buckets, data):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        with self.lock:
+            histograms = {
+                name: [
+                    {
+                        "labels": dict(key),
+                        "count": data[-2],
+                        "sum": data[-1],
+                        "mean": data[-1] / data[-2] if data[-2] else None,
+                        "p50": self._quantile(self.buckets, data, 0.5),
+                        "p95": self._quantile(self.buckets, data, 0.95),
+                        "p99": self._quantile(self.buckets, data, 0.99),
+                    }
+                    for key, data in series.items()
+                ]
+                for name, series in self.histograms.items()
+            }
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self.counters.items()
+            }
+            progress = self.progress.to_dict()
+        return {
+            "time": time.time(),
+            "progress": progress,
+            "histograms": histograms,
+            "counters": counters,
+        }
+
+    def render_prometheus(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.histograms.items()):
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, data in series.items():
+                    cumulative = 0
+                    for bound, n in zip(self.buckets, data):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {data[-2]}")
+                    lines.append(f"{name}_count{_format_labels(key)} {data[-2]}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {data[-1]}")
+            for name, series in sorted(self.counters.items()):
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            progress = self.progress.to_dict()
+        for key in ("done", "total", "items_per_sec", "eta_seconds"):
+            if progress[key] is not None:
+                lines.append(f"# TYPE progress_{key} gauge")
+                lines.append(f"progress_{key} {progress[key]}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics (prometheus text) and /metrics.json in a daemon thread."""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json"
+                elif self.path.startswith("/metrics"):
+                    body = metrics.render_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+    def write_snapshot(self, path):
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(temp, path)
+
+    def start_snapshots(self, path, interval=5.0):
+        """Rewrite the json snapshot file every `interval` seconds until `stop()`."""
+
+        def run():
+            while not self.stop_event.wait(interval):
+                self.write_snapshot(path)
+            self.write_snapshot(path)
+
+        self.snapshot_thread = threading.Thread(target=run, daemon=True)
+        self.snapshot_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.snapshot_thread is not None:
+            self.snapshot_thread.join()
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+# process wide registry used by the instrumented classes
+METRICS = Metrics()
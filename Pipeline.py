@@ -0,0 +1,188 @@
+import json
+import itertools
+import threading
+from queue import Queue
+from Tracer import TRACER
+
+_STOP = object()
+
+
+class TtsJob:
+    def __init__(self, speaker, text, params_hook=None, output=None, tag=None):
+        """
+        One (text, speaker) synthesis job flowing through TtsPipeline.
+
+        Args:
+            speaker: speaker style id
+            text: text to synthesize
+            params_hook: params to update the audio query with
+            output: output file path, passed to the writer
+            tag: free slot for the caller, e.g. the jsonl entry of the job
+        """
+        self.speaker = speaker
+        self.text = text
+        self.params_hook = params_hook or {}
+        self.output = output
+        self.tag = tag
+        self.cache_key = None
+        self.query = None
+        self.wav = None
+        self.future = None
+        self.error = None
+
+    def __repr__(self):
+        return f"TtsJob(speaker={self.speaker}, text={self.text[:20]!r})"
+
+
+class TtsPipeline:
+    def __init__(
+        self,
+        engine,
+        writer,
+        query_workers=2,
+        synthesis_workers=2,
+        writer_workers=2,
+        queue_size=8,
+    ):
+        """
+        Three stage pipeline: audio_query -> synthesis -> writer.
+
+        Every stage has its own worker threads and the stages are connected by
+        bounded queues, so the audio_query of the next sentence overlaps with
+        the synthesis of the current one and a slow stage blocks the stages
+        before it instead of piling up wav data in memory.
+
+        Args:
+            engine: VoicevoxEngine like object providing audio_query and synthesis
+            writer: callable(job) writing/compressing `job.wav` to `job.output`
+            query_workers: number of threads calling /audio_query
+            synthesis_workers: number of threads calling /synthesis
+            writer_workers: number of threads running the writer
+            queue_size: capacity of each queue between stages
+        """
+        self.engine = engine
+        self.writer = writer
+        self.query_workers = query_workers
+        self.synthesis_workers = synthesis_workers
+        self.writer_workers = writer_workers
+        self.queue_size = queue_size
+
+    def _query(self, job):
+        cache = getattr(self.engine, "cache", None)
+        if cache is not None:
+            job.cache_key = self.engine.cache_key(job.speaker, job.text, job.params_hook)
+            job.wav = cache.get(job.cache_key)
+            if job.wav is not None:
+                return
+        job.query = self.engine.make_query(job.speaker, job.text, job.params_hook)
+
+    def _synthesis(self, job):
+        if job.wav is not None:
+            return
+        job.wav = self.engine.synthesis(job.speaker, job.query)
+        job.query = None
+        if job.cache_key is not None:
+            self.engine.cache.put(job.cache_key, job.wav)
+
+    def _write(self, job):
+        self.writer(job)
+        job.wav = None
+
+    @staticmethod
+    def _worker(func, in_queue, out_queue):
+        while True:
+            job = in_queue.get()
+            if job is _STOP:
+                return
+            if job.error is None:
+                try:
+                    with TRACER.tags(speaker=job.speaker, text_len=len(job.text)):
+                        func(job)
+                except Exception as e:
+                    job.error = e
+            out_queue.put(job)
+
+    def run(self, jobs):
+        """
+        Feed `jobs` through the pipeline and yield every job once it is written,
+        failed jobs are yielded too with `job.error` set. Jobs are yielded in
+        completion order, not in input order.
+        """
+        query_queue = Queue(self.queue_size)
+        synthesis_queue = Queue(self.queue_size)
+        write_queue = Queue(self.queue_size)
+        done_queue = Queue(self.queue_size)
+
+        stages = [
+            (self._query, query_queue, synthesis_queue, self.query_workers),
+            (self._synthesis, synthesis_queue, write_queue, self.synthesis_workers),
+            (self._write, write_queue, done_queue, self.writer_workers),
+        ]
+        threads = [
+            [
+                threading.Thread(
+                    target=self._worker,
+                    args=(func, in_queue, out_queue),
+                    name=f"{func.__name__.strip('_')}-{i}",
+                    daemon=True,
+                )
+                for i in range(max(1, n))
+            ]
+            for func, in_queue, out_queue, n in stages
+        ]
+
+        feed_error = []
+
+        def feed():
+            try:
+                for job in jobs:
+                    query_queue.put(job)
+            except Exception as e:
+                feed_error.append(e)
+            # shut the stages down one after another so nothing is dropped
+            for (_, in_queue, _, _), workers in zip(stages, threads):
+                for _ in workers:
+                    in_queue.put(_STOP)
+                for t in workers:
+                    t.join()
+            done_queue.put(_STOP)
+
+        for workers in threads:
+            for t in workers:
+                t.start()
+        threading.Thread(target=feed, daemon=True).start()
+
+        while True:
+            job = done_queue.get()
+            if job is _STOP:
+                break
+            yield job
+        if feed_error:
+            raise feed_error[0]
+
+
+def iter_batched_jobs(engine, jobs, batch_size=16):
+    """
+    Synthesize jobs in groups of `batch_size` through `engine.tts_batch`, jobs
+    of the same speaker and params hook inside a group share one
+    /multi_synthesis round trip. Jobs are yielded in input order with `job.wav`
+    set.
+    """
+    jobs = iter(jobs)
+    while True:
+        chunk = list(itertools.islice(jobs, batch_size))
+        if not chunk:
+            return
+        groups = {}
+        for job in chunk:
+            key = (job.speaker, json.dumps(job.params_hook, sort_keys=True))
+            groups.setdefault(key, []).append(job)
+        for group in groups.values():
+            wavs = engine.tts_batch(
+                group[0].speaker,
+                [job.text for job in group],
+                params_hook=group[0].params_hook,
+            )
+            for job, wav in zip(group, wavs):
+                job.wav = wav
+        yield from chunk
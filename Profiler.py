@@ -0,0 +1,160 @@
+import io
+import sys
+import csv
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+# (title, pstats regex, tracemalloc file pattern) of the functions performance
+# tickets usually ask about
+FOCUS = [
+    ("engine requests and response json decode", r"\(req\)|json/decoder\.py|\(json\)", "*/json/decoder.py"),
+    ("AudioSegment construction", r"pydub/audio_segment\.py", "*/pydub/audio_segment.py"),
+    ("json.dumps of the output", r"json/(__init__|encoder)\.py", "*/json/encoder.py"),
+    ("genanki packaging", r"genanki/|AnkiBuilder\.py", "*/genanki/*"),
+]
+
+
+class Profiler:
+    def __init__(self, mode=None, output="profile", top=30, frames=16):
+        """
+        Optional cpu or memory profile of a run, written as ranked text reports.
+
+        "cpu" runs cProfile over the calling thread and every thread started
+        while it runs (pipeline stages, callbacks) and reports the functions by
+        cumulative and own time. "mem" traces allocations with tracemalloc and
+        reports the lines whose allocations grew between `start()` and
+        `stop()`. Both report the functions in FOCUS separately and what every
+        processed entry cost, see `entry_done()`. Compressor pool workers are
+        separate processes and not profiled.
+
+        Without a mode every method is a no-op.
+
+        Args:
+            mode: None, "cpu" or "mem"
+            output: prefix of the report files
+            top: functions / lines per ranking
+            frames: traceback depth stored by tracemalloc
+        """
+        assert mode in (None, "cpu", "mem"), f"unknown profile mode: {mode}"
+        self.mode = mode
+        self.output = output
+        self.top = top
+        self.frames = frames
+        self.profiles = []
+        self.entries = []  # (label, seconds, cpu seconds, bytes grown, bytes traced)
+        self.lock = threading.Lock()
+        self.baseline = None
+        self.snapshot = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        if self.mode == "cpu":
+            profile = cProfile.Profile()
+            self.profiles.append(profile)
+            if sys.version_info < (3, 12):
+                # profiling is per thread before 3.12, new threads get their own
+                threading.setprofile(self._profile_thread)
+            profile.enable()
+        elif self.mode == "mem":
+            tracemalloc.start(self.frames)
+            self.baseline = tracemalloc.take_snapshot()
+        self.last = (time.perf_counter(), time.process_time(), self._traced())
+
+    def _profile_thread(self, *args):
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        # replaces this hook for the rest of the thread
+        profile.enable()
+
+    def _traced(self):
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    def entry_done(self, label=""):
+        """Record the time and allocation growth since the last entry."""
+        if self.mode is None:
+            return
+        now = (time.perf_counter(), time.process_time(), self._traced())
+        with self.lock:
+            last, self.last = self.last, now
+            self.entries.append(
+                (label, now[0] - last[0], now[1] - last[1], now[2] - last[2], now[2])
+            )
+
+    def stop(self):
+        if self.mode == "cpu":
+            threading.setprofile(None)
+            self.profiles[0].disable()
+        elif self.mode == "mem" and tracemalloc.is_tracing():
+            self.snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+    def _cpu_report(self, f):
+        with self.lock:
+            profiles = list(self.profiles)
+        stats = pstats.Stats(profiles[0], stream=f)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(f"{self.output}.cpu.prof")
+        f.write(f"cpu profile of {len(profiles)} thread(s), raw stats in {self.output}.cpu.prof\n")
+        for key in ("cumulative", "tottime"):
+            f.write(f"\n==== top {self.top} by {key} ====\n")
+            stats.sort_stats(key).print_stats(self.top)
+        for title, pattern, _ in FOCUS:
+            f.write(f"\n==== {title} ====\n")
+            stats.sort_stats("cumulative").print_stats(pattern, self.top)
+
+    def _mem_report(self, f):
+        f.write(
+            f"allocation growth over the run, tracemalloc with {self.frames} frame(s)\n"
+            f"\n==== top {self.top} lines by growth ====\n"
+        )
+        for stat in self.snapshot.compare_to(self.baseline, "lineno")[: self.top]:
+            f.write(f"{stat}\n")
+        for title, _, pattern in FOCUS:
+            # allocations with the pattern anywhere in their traceback
+            filters = [tracemalloc.Filter(True, pattern, all_frames=True)]
+            diff = self.snapshot.filter_traces(filters).compare_to(
+                self.baseline.filter_traces(filters), "lineno"
+            )
+            grown = sum(stat.size_diff for stat in diff)
+            f.write(f"\n==== {title}: {grown / 1024:+.1f} KiB ====\n")
+            for stat in diff[: self.top // 3]:
+                f.write(f"{stat}\n")
+
+    def _entries_report(self, f):
+        if not self.entries:
+            return
+        key = 3 if self.mode == "mem" else 2
+        name = "allocation growth" if self.mode == "mem" else "cpu time"
+        f.write(f"\n==== {len(self.entries)} entries, top {self.top} by {name} ====\n")
+        for label, seconds, cpu, grown, traced in sorted(self.entries, key=lambda e: -e[key])[: self.top]:
+            f.write(f"{label}: {seconds:.4f}s wall, {cpu:.4f}s cpu, {grown / 1024:+.1f} KiB\n")
+        with open(f"{self.output}.{self.mode}.entries.csv", "w", encoding="utf-8", newline="") as ef:
+            writer = csv.writer(ef)
+            writer.writerow(["entry", "wall_seconds", "cpu_seconds", "bytes_grown", "bytes_traced"])
+            writer.writerows(self.entries)
+
+    def write(self):
+        """Write the report, return its path (None without a mode)."""
+        if self.mode is None:
+            return None
+        f = io.StringIO()
+        if self.mode == "cpu":
+            self._cpu_report(f)
+        else:
+            self._mem_report(f)
+        self._entries_report(f)
+        path = f"{self.output}.{self.mode}.txt"
+        with open(path, "w", encoding="utf-8") as out:
+            out.write(f.getvalue())
+        return path
@@ -0,0 +1,73 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class QueryStore:
+    def __init__(self, path="audio_query.db"):
+        """
+        SQLite store of raw /audio_query responses keyed by
+        (speaker, text, engine version).
+
+        The response only depends on those three, so params hook sweeps
+        (pitchScale, speedScale, ...) can reuse the stored query and skip the
+        text analysis of the engine.
+
+        Args:
+            path: sqlite database file
+        """
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS audio_query (
+                speaker INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                version TEXT NOT NULL,
+                query TEXT NOT NULL,
+                PRIMARY KEY (speaker, text, version)
+            )"""
+        )
+        self.conn.commit()
+
+    def get(self, speaker, text, version):
+        """Return a fresh dict of the stored query or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT query FROM audio_query WHERE speaker=? AND text=? AND version=?",
+                (int(speaker), text, version),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, speaker, text, version, query):
+        data = json.dumps(query, ensure_ascii=False)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO audio_query VALUES (?, ?, ?, ?)",
+                (int(speaker), text, version, data),
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def stats(self):
+        with self.lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM audio_query").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": count}
+
+    def __str__(self):
+        return str(self.stats())
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,70 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+
+DEFAULT_SPEAKER_CACHE = Path.home() / ".cache" / "voicevox_tools" / "speakers.json"
+
+
+class SpeakerCache:
+    def __init__(self, path=DEFAULT_SPEAKER_CACHE, ttl=24 * 60 * 60):
+        """
+        On-disk cache of the /speakers response of every engine, so building a
+        VoicevoxEngine and listing speakers needs no network call.
+
+        Entries are keyed by base url and remember the engine version they were
+        fetched from, an entry older than `ttl` seconds or whose version differs
+        from the engine's is refetched.
+
+        Args:
+            path: json file to store the speakers in
+            ttl: time to live of an entry in seconds
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, base_url, version=None):
+        """Return the cached entry `{"version", "fetched_at", "speakers"}` or None."""
+        with self.lock:
+            entry = self._load().get(base_url)
+        if entry is None:
+            return None
+        if time.time() - entry["fetched_at"] > self.ttl:
+            return None
+        if version is not None and entry["version"] != version:
+            return None
+        return entry
+
+    def put(self, base_url, version, speakers):
+        with self.lock:
+            data = self._load()
+            data[base_url] = {
+                "version": version,
+                "fetched_at": time.time(),
+                "speakers": speakers,
+            }
+            self._save(data)
+
+    def _save(self, data):
+        # readers in other processes never see a partially written file
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp, self.path)
+
+    def invalidate(self, base_url):
+        with self.lock:
+            data = self._load()
+            if data.pop(base_url, None) is None:
+                return
+            self._save(data)
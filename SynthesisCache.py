@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+
+class SynthesisCache:
+    def __init__(self, cache_dir=".synthesis_cache", max_bytes=1024 * 1024 * 1024):
+        """
+        Content addressed on-disk cache of synthesized wav blobs.
+
+        Blobs are stored as `<cache_dir>/<key[:2]>/<key>.wav`, when the total
+        size exceeds `max_bytes` the least recently used blobs are evicted.
+        The access order survives restarts through the files' mtime.
+
+        Args:
+            cache_dir: directory to store wav blobs in
+            max_bytes: size budget of the cache in bytes
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size, oldest first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.init()
+
+    def init(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        blobs = []
+        for path in self.cache_dir.glob("*/*.wav"):
+            stat = path.stat()
+            blobs.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(blobs):
+            self.entries[key] = size
+            self.total_bytes += size
+        self._evict()
+
+    @staticmethod
+    def key(speaker, text, params_hook, version, **kwargs):
+        """
+        Key of one synthesis. The final query is fully determined by the
+        audio_query of (speaker, text) on a given engine version plus the
+        params hook, so hashing those avoids an /audio_query call on hits.
+        """
+        payload = {
+            "speaker": int(speaker),
+            "text": text,
+            "params": params_hook,
+            "version": version,
+        }
+        payload.update(kwargs)
+        data = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.wav"
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.total_bytes -= self.entries.pop(key, 0)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        temp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+        with self.lock:
+            self.total_bytes += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def __str__(self):
+        return str(self.stats())
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,165 @@
+import re
+import json
+import hashlib
+import unicodedata
+import threading
+from collections import OrderedDict
+
+
+def normalize_word(text):
+    """
+    Normalize a word like the extractor of the anki deck: strip 〜 at both
+    ends, drop [furigana] and (notes) and remove spaces.
+    """
+    if text.startswith("〜"):
+        text = text[1:]
+    if text.endswith("〜"):
+        text = text[:-1]
+    text = re.sub(r"\[.*?\]", "", text)
+    text = re.sub(r"\(.*?\)", "", text)
+    return text.replace("　", "").replace(" ", "")
+
+
+def normalize_sentence(text):
+    """
+    Normalize a free-form sentence without changing what is spoken: NFKC
+    (full-width latin and digits, compatibility characters) and outer
+    whitespace only.
+    """
+    return unicodedata.normalize("NFKC", text).strip()
+
+
+class PlannedJob:
+    __slots__ = ("key", "text", "speaker", "params_hook", "targets", "requests", "done", "error")
+
+    def __init__(self, key, text, speaker, params_hook):
+        self.key = key
+        self.text = text
+        self.speaker = speaker
+        self.params_hook = params_hook
+        self.targets = []
+        self.requests = 0
+        self.done = False
+        self.error = None
+
+    def __str__(self):
+        return f"PlannedJob({self.speaker}, {self.text!r}, requests={self.requests})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class FinishedJob:
+    __slots__ = ("error",)
+    done = True
+
+    def __init__(self, error=None):
+        """What a compact planner keeps of a finished job."""
+        self.error = error
+
+
+_SUCCEEDED = FinishedJob()
+
+
+class SynthesisPlanner:
+    def __init__(self, normalize=normalize_word, compact=False, max_finished=None):
+        """
+        Deduplicate synthesis requests into unique (text, speaker, params hook)
+        jobs, texts are compared after `normalize`.
+
+        Every request registers a target (a deck, an entry, ...), a job is
+        synthesized once and `finish` hands back all targets waiting for it.
+        Targets added after a job finished are reported as "done" right away,
+        so requests can be added while earlier jobs are still running.
+
+        With `compact`, a finished job is replaced by a FinishedJob holding
+        only its error message under a digest of its key, about 100 bytes per
+        unique text. Finished jobs are then no longer iterated. `max_finished`
+        bounds how many of them are kept, the least recently requested are
+        forgotten first and synthesized again if they come back, so memory
+        stays flat for streams of millions of unique texts.
+        """
+        assert max_finished is None or compact, "max_finished needs compact"
+        self.normalize = normalize or (lambda text: text)
+        self.compact = compact
+        self.max_finished = max_finished
+        self.jobs = {}  # key digest -> PlannedJob, or FinishedJob without compact
+        self.finished = OrderedDict()  # key digest -> FinishedJob, with compact
+        self.requested = 0
+        self.unique = 0
+        self.lock = threading.Lock()
+
+    def key(self, text, speaker, params_hook=None):
+        data = json.dumps(
+            [self.normalize(text), int(speaker), params_hook or {}],
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.blake2b(data.encode("utf-8"), digest_size=16).digest()
+
+    def add(self, text, speaker, params_hook=None, target=None):
+        """
+        Request a synthesis, return (job, status): "new" when the caller has to
+        synthesize the job, "queued" when the target is handed back by
+        `finish`, "done" when the job already finished and the target is not
+        kept.
+        """
+        key = self.key(text, speaker, params_hook)
+        with self.lock:
+            self.requested += 1
+            job = self.jobs.get(key)
+            if job is None and key in self.finished:
+                job = self.finished[key]
+                self.finished.move_to_end(key)
+            status = "queued"
+            if job is None:
+                job = self.jobs[key] = PlannedJob(key, text, int(speaker), params_hook or {})
+                self.unique += 1
+                status = "new"
+            if isinstance(job, PlannedJob):
+                job.requests += 1
+            if job.done:
+                return job, "done"
+            job.targets.append(target)
+            return job, status
+
+    def get(self, text, speaker, params_hook=None):
+        """The job planned for a request, None when unknown or compacted."""
+        with self.lock:
+            return self.jobs.get(self.key(text, speaker, params_hook))
+
+    def finish(self, job, error=None):
+        """Mark the job finished and return its targets."""
+        with self.lock:
+            job.done = True
+            job.error = error
+            targets, job.targets = job.targets, []
+            if self.compact:
+                del self.jobs[job.key]
+                self.finished[job.key] = _SUCCEEDED if error is None else FinishedJob(str(error))
+                if self.max_finished is not None and len(self.finished) > self.max_finished:
+                    self.finished.popitem(last=False)
+        return targets
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.jobs.values()))
+
+    def __len__(self):
+        return len(self.jobs) + len(self.finished)
+
+    def stats(self):
+        with self.lock:
+            unique = self.unique
+            return {
+                "requested": self.requested,
+                "unique": unique,
+                "saved": self.requested - unique,
+            }
+
+    def report(self):
+        stats = self.stats()
+        return (
+            f"{stats['unique']} synthesis job(s) for {stats['requested']} request(s), "
+            f"{stats['saved']} call(s) saved"
+        )
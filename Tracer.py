@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import threading
+
+
+def _now_us():
+    # wall clock, so spans of worker processes line up with the parent's
+    return time.time_ns() / 1000
+
+
+class Tracer:
+    def __init__(self):
+        """
+        Recorder of per-entry spans written as a Chrome trace
+        (chrome://tracing, https://ui.perfetto.dev).
+
+        Every span is a complete ("X") event on the track of the thread that
+        ran it, so idle gaps and stages waiting on each other show up as holes
+        and stairs between the tracks. Spans take the tags of the enclosing
+        `tags()` block of their thread (speaker, text length, ...) as args.
+
+        The tracer is disabled until `enable()`, `span()` and `tags()` are
+        no-ops then. Worker processes `drain()` their events and the parent
+        `merge()`s them, see CompressorPool.
+        """
+        self.enabled = False
+        self.events = []
+        self.threads = {}  # (pid, tid) -> thread name
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def current_tags(self):
+        return getattr(self.local, "tags", {})
+
+    def tags(self, **tags):
+        """Context manager adding `tags` to the args of the spans of this thread."""
+        if not self.enabled:
+            return _NULL
+        return _Tags(self, tags)
+
+    def span(self, name, **args):
+        """Context manager recording its block as a span named `name`."""
+        if not self.enabled:
+            return _NULL
+        return _Span(self, name, args)
+
+    def add(self, name, start, end, args):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": start,
+            "dur": end - start,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": {k: v for k, v in {**self.current_tags(), **args}.items() if v is not None},
+        }
+        with self.lock:
+            self.events.append(event)
+            self.threads.setdefault((event["pid"], event["tid"]), thread.name)
+
+    def drain(self):
+        """Return and reset the recorded events, e.g. to ship them out of a worker process."""
+        with self.lock:
+            data = {
+                "events": self.events,
+                "threads": [[pid, tid, name] for (pid, tid), name in self.threads.items()],
+            }
+            self.events = []
+            self.threads = {}
+        return data
+
+    def merge(self, data):
+        with self.lock:
+            self.events.extend(data["events"])
+            for pid, tid, name in data["threads"]:
+                self.threads.setdefault((pid, tid), name)
+
+    def write(self, path):
+        """Write the trace json, timestamps start at the first span."""
+        with self.lock:
+            events = sorted(self.events, key=lambda e: e["ts"])
+            threads = dict(self.threads)
+        origin = events[0]["ts"] if events else 0
+        pids = {pid for pid, _ in threads}
+        meta = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": "main" if pid == os.getpid() else f"worker {pid}"},
+            }
+            for pid in sorted(pids)
+        ] + [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for (pid, tid), name in threads.items()
+        ]
+        trace = {
+            "traceEvents": meta + [{**e, "ts": e["ts"] - origin} for e in events],
+            "displayTimeUnit": "ms",
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, ensure_ascii=False)
+        return len(events)
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add(self.name, self.start, _now_us(), self.args)
+
+
+class _Tags:
+    def __init__(self, tracer, tags):
+        self.tracer = tracer
+        self.tags = tags
+
+    def __enter__(self):
+        self.previous = self.tracer.current_tags()
+        self.tracer.local.tags = {**self.previous, **self.tags}
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.local.tags = self.previous
+
+
+class _Null:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL = _Null()
+
+# process wide tracer used by the instrumented classes
+TRACER = Tracer()
@@ -1,9 +1,43 @@
+import io
+import time
+import random
+import zipfile
+import threading
+import unicodedata
 import requests
 from pprint import pprint
 from pathlib import Path
+from urllib.parse import urlparse
+from Metrics import METRICS
+from Tracer import TRACER
+
+# (connect, read) timeouts in seconds per endpoint
+DEFAULT_TIMEOUTS = {
+    "default": (3.05, 60),
+    "/synthesis": (3.05, 180),
+    "/multi_synthesis": (3.05, 600),
+    "/initialize_speaker": (3.05, 300),
+}
+
+# endpoints without side effects on the engine, safe to send more than once
+IDEMPOTENT_ENDPOINTS = {
+    "/audio_query",
+    "/synthesis",
+    "/multi_synthesis",
+    "/initialize_speaker",
+    "/is_initialized_speaker",
+}
+
+
+class VoicevoxEngineError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
 
 
 class SpeakerStyle:
+    __slots__ = ("id", "name", "type")
+
     def __init__(self, id: int, name: str, type: str):
         self.id = id
         self.name = name
@@ -24,6 +58,8 @@ class SpeakerStyle:
 
 
 class SpeakerSupportedFeatures:
+    __slots__ = ("permitted_synthesis_morphing",)
+
     def __init__(self, permitted_synthesis_morphing: str):
         self.permitted_synthesis_morphing = permitted_synthesis_morphing
 
@@ -40,6 +76,8 @@ class SpeakerSupportedFeatures:
 
 
 class SpeakerStylesInfo:
+    __slots__ = ("name", "speaker_uuid", "styles", "version", "supported_features")
+
     def __init__(
         self,
         name: str,
@@ -70,18 +108,171 @@ class SpeakerStylesInfo:
         return str(self.to_dict())
 
 
+class SpeakerCatalog:
+    __slots__ = ("speakers", "by_style_id", "by_uuid", "by_name", "by_substring")
+
+    def __init__(self, speakers):
+        """
+        Speakers indexed once by style id, uuid, normalized name and every
+        substring of the normalized name, so lookups don't scan the speakers.
+        """
+        self.speakers = list(speakers)
+        self.by_style_id = {}
+        self.by_uuid = {}
+        self.by_name = {}
+        self.by_substring = {}
+        for ss in self.speakers:
+            self.by_uuid[ss.speaker_uuid] = ss
+            for style in ss.styles:
+                self.by_style_id[style.id] = (ss, style)
+            name = self.normalize(ss.name)
+            self.by_name.setdefault(name, []).append(ss)
+            substrings = {
+                name[i:j] for i in range(len(name)) for j in range(i + 1, len(name) + 1)
+            }
+            for sub in substrings:
+                self.by_substring.setdefault(sub, []).append(ss)
+
+    @staticmethod
+    def normalize(name):
+        return unicodedata.normalize("NFKC", name).lower()
+
+    def __len__(self):
+        return len(self.speakers)
+
+    def __iter__(self):
+        return iter(self.speakers)
+
+    def style(self, style_id):
+        """Return `(SpeakerStylesInfo, SpeakerStyle)` of a style id or None."""
+        return self.by_style_id.get(int(style_id))
+
+    def find(self, speaker_uuid=None, name=None, amb_match=True):
+        key = self.normalize(name) if name else None
+        if speaker_uuid:
+            ss = self.by_uuid.get(speaker_uuid)
+            candidates = [ss] if ss else []
+        elif name:
+            candidates = (self.by_substring if amb_match else self.by_name).get(key, [])
+        else:
+            candidates = self.speakers
+        if name and not amb_match:
+            candidates = [ss for ss in candidates if ss.name == name]
+        elif name:
+            candidates = [ss for ss in candidates if key in self.normalize(ss.name)]
+        return list(candidates)
+
+
 class VoicevoxEngine:
 
     def __init__(
         self,
         base_url: str = "http://localhost:50021",
         device: str = "cuda",
+        cache=None,
+        query_store=None,
+        timeouts: dict = None,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        backoff_max: float = 8.0,
+        speaker_cache=None,
+        output_profile: dict = None,
     ):
+        """
+        Nothing is requested from the engine here, the device is checked
+        before the first request and the speakers are loaded on first access.
+
+        Args:
+            base_url: base url of Voicevox Engine
+            device: device the engine should run on
+            cache: optional SynthesisCache, synthesized wavs are looked up there
+                before calling the engine
+            query_store: optional QueryStore, /audio_query responses are read
+                from there so only /synthesis hits the engine on reruns
+            timeouts: (connect, read) timeouts per endpoint path, merged into
+                DEFAULT_TIMEOUTS, the "default" key applies to other endpoints
+            max_retries: retries of idempotent requests on connection errors,
+                timeouts and 5xx responses
+            backoff: base delay of the jittered exponential backoff in seconds
+            backoff_max: upper bound of one backoff delay in seconds
+            speaker_cache: optional SpeakerCache, speakers are read from there
+                instead of /speakers while the entry is fresh
+            output_profile: query fields applied before the params hook, e.g.
+                {"outputSamplingRate": 22050, "outputStereo": False} from
+                Compressor.output_profile() so the encoder needs no resampling
+        """
         self.session = requests.Session()
         self.base_url = base_url
-        self.device = self.check_devices(device)
-        self.speakers = [SpeakerStylesInfo(**ss) for ss in self.get_speakers()]
-        pass
+        self.cache = cache
+        self.query_store = query_store
+        self.batch_max_items = 32
+        self.batch_max_moras = 2000
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.call_stats = {}
+        self.stats_lock = threading.Lock()
+        self.speaker_cache = speaker_cache
+        self.output_profile = output_profile or {}
+        self.init_lock = threading.Lock()
+        self._version = None
+        self._requested_device = device
+        self._device = None
+        self._speakers = None
+        self._speakers_version = None
+        self._catalog = None
+
+    @property
+    def device(self):
+        if self._device is None:
+            with self.init_lock:
+                if self._device is None:
+                    self._device = self.check_devices(self._requested_device)
+        return self._device
+
+    @property
+    def speakers(self):
+        if self._speakers is None:
+            self.load_speakers()
+        return self._speakers
+
+    @speakers.setter
+    def speakers(self, speakers):
+        self._speakers = [
+            ss if isinstance(ss, SpeakerStylesInfo) else SpeakerStylesInfo(**ss)
+            for ss in speakers
+        ]
+        self._catalog = None
+
+    @property
+    def catalog(self):
+        if self._catalog is None or self._speakers is None:
+            self._catalog = SpeakerCatalog(self.speakers)
+        return self._catalog
+
+    def load_speakers(self, refresh=False):
+        entry = None
+        if self.speaker_cache is not None and not refresh:
+            entry = self.speaker_cache.get(self.base_url, self._version)
+        if entry is None:
+            entry = {"version": self.version, "speakers": self.get_speakers()}
+            if self.speaker_cache is not None:
+                self.speaker_cache.put(self.base_url, entry["version"], entry["speakers"])
+        self._speakers_version = entry["version"]
+        self.speakers = entry["speakers"]
+        return self._speakers
+
+    def _count(self, endpoint, key, n=1):
+        with self.stats_lock:
+            stats = self.call_stats.setdefault(
+                endpoint, {"calls": 0, "retries": 0, "errors": 0}
+            )
+            stats[key] += n
+
+    def stats(self):
+        with self.stats_lock:
+            return {k: dict(v) for k, v in self.call_stats.items()}
 
     def req(self, *args, **kwargs):
         return_type = "json()"
@@ -90,15 +281,89 @@ class VoicevoxEngine:
             return_type = kwargs.pop("return_type")
         if "success_code" in kwargs:
             success_code = kwargs.pop("success_code")
-        response = self.session.request(*args, **kwargs)
-
+        method = args[0] if args else kwargs.get("method")
+        url = args[1] if len(args) > 1 else kwargs.get("url", "")
+        endpoint = urlparse(url).path
+        if self._device is None and endpoint != "/supported_devices":
+            self.device
+        kwargs.setdefault(
+            "timeout", self.timeouts.get(endpoint, self.timeouts["default"])
+        )
+        retries = self.max_retries
+        if method != "GET" and endpoint not in IDEMPOTENT_ENDPOINTS:
+            retries = 0
+
+        self._count(endpoint, "calls")
+        speaker = (kwargs.get("params") or {}).get("speaker")
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(*args, **kwargs)
+                if response.status_code >= 500 or response.status_code == 429:
+                    error = VoicevoxEngineError(
+                        f"response returned status code: {response.status_code}",
+                        response.status_code,
+                    )
+                else:
+                    error = None
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                response, error = None, e
+            if error is None or attempt >= retries:
+                break
+            attempt += 1
+            self._count(endpoint, "retries")
+            # full jitter keeps retrying clients from hitting the engine in lockstep
+            time.sleep(random.uniform(0, min(self.backoff_max, self.backoff * 2**attempt)))
+
+        METRICS.observe(
+            "voicevox_request_seconds",
+            time.perf_counter() - start,
+            endpoint=endpoint,
+            speaker=speaker,
+        )
+        if response is None:
+            self._count(endpoint, "errors")
+            METRICS.inc(
+                "voicevox_request_errors_total",
+                endpoint=endpoint,
+                speaker=speaker,
+                error=type(error).__name__,
+            )
+            raise error
+
+        body = response.request.body if response.request is not None else None
+        METRICS.inc(
+            "voicevox_request_bytes_total",
+            len(body or b""),
+            endpoint=endpoint,
+            speaker=speaker,
+            direction="sent",
+        )
+        METRICS.inc(
+            "voicevox_request_bytes_total",
+            len(response.content),
+            endpoint=endpoint,
+            speaker=speaker,
+            direction="received",
+        )
         if response.status_code != success_code:
+            self._count(endpoint, "errors")
+            METRICS.inc(
+                "voicevox_request_errors_total",
+                endpoint=endpoint,
+                speaker=speaker,
+                error=response.status_code,
+            )
             try:
                 pprint(response.json())
             except:
                 # pprint(response)
                 pass
-            raise Exception(f"response returned status code: {response.status_code}")
+            raise VoicevoxEngineError(
+                f"response returned status code: {response.status_code}",
+                response.status_code,
+            )
 
         try:
             if not return_type:
@@ -132,6 +397,21 @@ class VoicevoxEngine:
 
         return device
 
+    def get_version(self):
+        return self.req(
+            "GET",
+            f"{self.base_url}/version",
+        )
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = self.get_version()
+            if self._speakers_version not in (None, self._version):
+                # speakers came from the cache of another engine version
+                self._speakers = None
+        return self._version
+
     def get_speakers(self):
         return self.req(
             "GET",
@@ -161,11 +441,20 @@ class VoicevoxEngine:
         speaker: int,
         text: str,
     ):
-        return self.req(
-            "POST",
-            f"{self.base_url}/audio_query",
-            params={"text": text, "speaker": speaker},
-        )
+        """returns a new dict on every call, so it is safe to update it in place"""
+        with TRACER.span("audio_query", speaker=speaker, text_len=len(text), engine=self.base_url):
+            if self.query_store is not None:
+                params = self.query_store.get(speaker, text, self.version)
+                if params is not None:
+                    return params
+            params = self.req(
+                "POST",
+                f"{self.base_url}/audio_query",
+                params={"text": text, "speaker": speaker},
+            )
+        if self.query_store is not None:
+            self.query_store.put(speaker, text, self.version, params)
+        return params
 
     def update_params(
         self,
@@ -181,19 +470,87 @@ class VoicevoxEngine:
         params: dict,
         enable_interrogative_upspeak=True,
     ):
-        return self.req(
-            "POST",
-            f"{self.base_url}/synthesis",
-            json=params,
-            params={
-                "enable_interrogative_upspeak": enable_interrogative_upspeak,
-                "speaker": speaker,
-            },
-            return_type="content",
+        with TRACER.span("synthesis", speaker=speaker, moras=self.count_moras(params), engine=self.base_url):
+            return self.req(
+                "POST",
+                f"{self.base_url}/synthesis",
+                json=params,
+                params={
+                    "enable_interrogative_upspeak": enable_interrogative_upspeak,
+                    "speaker": speaker,
+                },
+                return_type="content",
+            )
+
+    @staticmethod
+    def count_moras(params: dict):
+        return sum(
+            len(ap["moras"]) + (1 if ap.get("pause_mora") else 0)
+            for ap in params.get("accent_phrases", [])
         )
 
+    def split_batches(self, queries, max_items=None, max_moras=None):
+        """
+        Split queries into batches for /multi_synthesis, a batch is closed when
+        it reaches `max_items` queries or `max_moras` moras, so short vocabulary
+        items are packed densely while long sentences don't make one request
+        block for too long.
+        """
+        max_items = max_items or self.batch_max_items
+        max_moras = max_moras or self.batch_max_moras
+        batch, moras = [], 0
+        for query in queries:
+            query_moras = self.count_moras(query)
+            if batch and (len(batch) >= max_items or moras + query_moras > max_moras):
+                yield batch
+                batch, moras = [], 0
+            batch.append(query)
+            moras += query_moras
+        if batch:
+            yield batch
+
+    def synthesis_batch(
+        self,
+        speaker: int,
+        queries: list,
+        max_items=None,
+        max_moras=None,
+    ):
+        """
+        Synthesize a list of audio queries via /multi_synthesis, returns the
+        wav bytes in the order of `queries`. The zip returned by the engine is
+        unpacked in memory.
+        """
+        wavs = []
+        for batch in self.split_batches(queries, max_items, max_moras):
+            with TRACER.span(
+                "synthesis",
+                speaker=speaker,
+                items=len(batch),
+                moras=sum(self.count_moras(query) for query in batch),
+                engine=self.base_url,
+            ):
+                content = self.req(
+                    "POST",
+                    f"{self.base_url}/multi_synthesis",
+                    json=batch,
+                    params={"speaker": speaker},
+                    return_type="content",
+                )
+            with zipfile.ZipFile(io.BytesIO(content)) as zf:
+                names = sorted(
+                    zf.namelist(),
+                    key=lambda n: int(Path(n).stem) if Path(n).stem.isdigit() else n,
+                )
+                if len(names) != len(batch):
+                    raise Exception(
+                        f"multi_synthesis returned {len(names)} wav(s) for {len(batch)} queries"
+                    )
+                wavs.extend(zf.read(name) for name in names)
+        return wavs
+
     def refresh_speaker(self):
-        self.speakers = self.get_speakers()
+        return self.load_speakers(refresh=True)
 
     def get_speaker_style(
         self,
@@ -206,25 +563,11 @@ class VoicevoxEngine:
             "at least one of speaker_uuid or name is required"
         )
 
-        def uuid_filter(speaker):
-            if not speaker_uuid:
-                return True
-            return speaker.speaker_uuid == speaker_uuid
-
-        def name_filter(speaker):
-            if not name:
-                return True
-            if amb_match:
-                return name.lower() in speaker.name.lower()
-            return speaker.name == name
-
-        def speaker_filter(speaker):
-            return uuid_filter(speaker) and name_filter(speaker)
-
+        speakers = self.catalog.find(speaker_uuid, name, amb_match)
         if return_dict:
-            return [i.to_dict() for i in filter(speaker_filter, self.speakers)]
+            return [i.to_dict() for i in speakers]
 
-        return list(filter(speaker_filter, self.speakers))
+        return speakers
 
     def speaker_init_check(self, **kwargs):
         """
@@ -254,6 +597,25 @@ class VoicevoxEngine:
         )
         return True
 
+    def cache_key(self, speaker, text, params_hook: dict = {}):
+        if self.output_profile:
+            return self.cache.key(
+                speaker,
+                text,
+                params_hook,
+                self.version,
+                output_profile=self.output_profile,
+            )
+        return self.cache.key(speaker, text, params_hook, self.version)
+
+    def make_query(self, speaker, text, params_hook: dict = {}):
+        """audio_query with the output profile and then the params hook applied"""
+        params = self.audio_query(speaker, text)
+        params.update(self.output_profile)
+        # params = self.update_params(params, **params_hook)
+        params.update(params_hook)
+        return params
+
     def tts(
         self,
         speaker,
@@ -262,21 +624,60 @@ class VoicevoxEngine:
         output=None,
         overwrite=False,
     ):
-        params = self.audio_query(speaker, text)
-        # params = self.update_params(params, **params_hook)
-        params.update(params_hook)
-        wav = self.synthesis(speaker, params)
+        start = time.perf_counter()
+        wav = None
+        cache_key = None
+        cache = "off"
+        if self.cache is not None:
+            cache_key = self.cache_key(speaker, text, params_hook)
+            wav = self.cache.get(cache_key)
+            cache = "miss" if wav is None else "hit"
+        if wav is None:
+            params = self.make_query(speaker, text, params_hook)
+            wav = self.synthesis(speaker, params)
+            if cache_key is not None:
+                self.cache.put(cache_key, wav)
+        METRICS.observe("voicevox_tts_seconds", time.perf_counter() - start, speaker=speaker, cache=cache)
         if output:
             output = Path(output)
             if not output.is_file() or overwrite:
                 assert output.parent.is_dir(), Exception(
                     f"output directory {output.parent} does not exist"
                 )
-                with open(output, "wb") as f:
-                    f.write(wav)
+                with METRICS.time("file_write_seconds", format="wav"), TRACER.span("file_write", format="wav"):
+                    with open(output, "wb") as f:
+                        f.write(wav)
             return
         return wav
 
+    def tts_batch(
+        self,
+        speaker,
+        texts,
+        params_hook: dict = {},
+    ):
+        """
+        Batched `tts` for one speaker, returns a list of wav bytes in the order
+        of `texts`. Cached wavs are reused and only the misses are sent to
+        /multi_synthesis.
+        """
+        wavs = [None] * len(texts)
+        cache_keys = [None] * len(texts)
+        missing = []
+        for idx, text in enumerate(texts):
+            if self.cache is not None:
+                cache_keys[idx] = self.cache_key(speaker, text, params_hook)
+                wavs[idx] = self.cache.get(cache_keys[idx])
+            if wavs[idx] is None:
+                missing.append(idx)
+
+        queries = [self.make_query(speaker, texts[idx], params_hook) for idx in missing]
+        for idx, wav in zip(missing, self.synthesis_batch(speaker, queries)):
+            wavs[idx] = wav
+            if cache_keys[idx] is not None:
+                self.cache.put(cache_keys[idx], wav)
+        return wavs
+
 
 if __name__ == "__main__":
     base_url = "http://localhost:50021"
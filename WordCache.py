@@ -0,0 +1,119 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class WordCache:
+    def __init__(self, path="words.db", migrate_from=None, just_long=6):
+        """
+        SQLite store of the ids that name the audio files of words.
+
+        Ids are allocated like the former words.json cache: the first word
+        gets 0, every new word the next integer, zero padded to `just_long`
+        digits. A words.json given as `migrate_from` is imported when the
+        store is empty, so existing output directories stay valid.
+
+        Every allocation is its own short write transaction, `get_ids`
+        allocates many words in one, no transaction stays open between calls
+        so several processes can share the store.
+
+        Args:
+            path: sqlite database file
+            migrate_from: optional words.json of the former cache
+            just_long: digits of an id
+        """
+        self.path = Path(path)
+        self.just_long = just_long
+        self.ids = {}  # ids never change, lookups are memoized
+        self.lock = threading.Lock()
+        # autocommit mode, transactions are started explicitly
+        self.conn = sqlite3.connect(
+            self.path,
+            timeout=60,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS words (
+                id INTEGER PRIMARY KEY,
+                word TEXT NOT NULL UNIQUE
+            )"""
+        )
+        if migrate_from is not None:
+            self.migrate(migrate_from)
+
+    def migrate(self, json_path):
+        json_path = Path(json_path)
+        if not json_path.is_file():
+            return
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.conn.execute("SELECT 1 FROM words LIMIT 1").fetchone() is None:
+                    with open(json_path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    self.conn.executemany(
+                        "INSERT INTO words VALUES (?, ?)",
+                        ((int(i), word) for word, i in data["cache"].items()),
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _format(self, idx):
+        return str(idx).rjust(self.just_long, "0")
+
+    def _lookup(self, key):
+        row = self.conn.execute("SELECT id FROM words WHERE word=?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def get_id(self, key):
+        return self.get_ids([key])[0]
+
+    def get_ids(self, keys):
+        """Ids of `keys`, the missing ones are allocated in one transaction."""
+        keys = list(keys)
+        missing = [key for key in dict.fromkeys(keys) if key not in self.ids]
+        if missing:
+            with self.lock:
+                found = {key: self._lookup(key) for key in missing}
+                if any(idx is None for idx in found.values()):
+                    # take the write lock first, another process may add the words
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        for key in missing:
+                            idx = self._lookup(key)
+                            if idx is None:
+                                idx = self.conn.execute(
+                                    "INSERT INTO words VALUES ((SELECT COALESCE(MAX(id), -1) + 1 FROM words), ?)",
+                                    (key,),
+                                ).lastrowid
+                            found[key] = idx
+                        self.conn.execute("COMMIT")
+                    except BaseException:
+                        self.conn.execute("ROLLBACK")
+                        raise
+                for key, idx in found.items():
+                    self.ids[key] = self._format(idx)
+        return [self.ids[key] for key in keys]
+
+    def save(self):
+        """Ids are committed when they are allocated, kept for compatibility."""
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM words").fetchone()[0]
+
+    def __str__(self):
+        return f"WordCache({self.path}, {len(self)} words)"
+
+    def __repr__(self):
+        return self.__str__()
@@ -0,0 +1,329 @@
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from queue import Empty
+from pathlib import Path
+import stub_server
+from VoicevoxEngine import VoicevoxEngine
+from Compressor import Compressor
+from CompressorPool import CompressorPool
+from Pipeline import TtsJob, TtsPipeline, iter_batched_jobs
+from SynthesisPlanner import SynthesisPlanner
+
+SCENARIOS = ["jsonl", "anki", "compress"]
+_KANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="offline throughput benchmark against a stub Voicevox Engine"
+    )
+    parser.add_argument(
+        "--scenario",
+        type=str,
+        nargs="+",
+        default=SCENARIOS,
+        choices=SCENARIOS,
+        help="scenarios to run, each one in its own process",
+    )
+    parser.add_argument("--items", type=int, default=200, help="jsonl entries / anki words / clips")
+    parser.add_argument("--speaker_ids", type=int, nargs="+", default=[13, 23])
+    parser.add_argument(
+        "--duplicates",
+        type=float,
+        default=0.2,
+        help="share of repeated sentences / words shared between decks",
+    )
+    parser.add_argument("--min_moras", type=int, default=4)
+    parser.add_argument("--max_moras", type=int, default=40)
+    parser.add_argument(
+        "--mode",
+        type=str,
+        default="pipeline",
+        choices=["sequential", "pipeline", "batch"],
+        help="how the jsonl scenario synthesizes, like main.py's --pipeline / --batch_size",
+    )
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--compress", action="store_true", help="compress in the jsonl scenario")
+    parser.add_argument("--compress_format", type=str, default="mp3", choices=["mp3", "opus", "aac"])
+    parser.add_argument("--compress_quality", type=str, default="small")
+    parser.add_argument(
+        "--compress_workers",
+        type=int,
+        default=0,
+        help="compressor processes, 0 encodes in the calling thread",
+    )
+    parser.add_argument(
+        "--latency",
+        type=str,
+        action="append",
+        default=[],
+        help="<path>=<spec> latency of a stub endpoint, see stub_server.parse_latency "
+        "(default: /audio_query=lognormal:0.01,0.3 /synthesis=lognormal:0.03,0.4)",
+    )
+    parser.add_argument("--latency_per_mora", type=float, default=0.0005)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default="", help="json file of the report, stdout if empty")
+    return parser.parse_args()
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    return {
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "mean": sum(values) / len(values),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on linux, in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+def make_texts(n, duplicates, min_moras, max_moras, rng):
+    unique = max(1, int(n * (1 - duplicates)))
+    pool = [
+        "".join(rng.choice(_KANA) for _ in range(rng.randint(min_moras, max_moras)))
+        for _ in range(unique)
+    ]
+    return pool + [rng.choice(pool) for _ in range(n - unique)]
+
+
+def _serve_stub(conn, latency, latency_per_mora):
+    engine = stub_server.StubEngine(latency=latency, latency_per_mora=latency_per_mora)
+    server = stub_server.start(engine)
+    conn.send(server.server_port)
+    conn.recv()  # stop
+    conn.send(engine.counts)
+
+
+def make_compressor(args):
+    compressor = Compressor(out_fmt=args.compress_format)
+    compressor.set_quality(args.compress_quality)
+    return compressor
+
+
+def run_jsonl(args, base_url, work_dir, rng):
+    """Synthesize jsonl entries like main.py: one job per entry and speaker."""
+    from main import save_audio, make_file_id
+
+    compressor = make_compressor(args) if args.compress else None
+    engine = VoicevoxEngine(base_url, device="cpu")
+    if compressor is not None:
+        engine.output_profile = compressor.output_profile()
+    pool = CompressorPool(compressor, workers=args.compress_workers) if compressor and args.compress_workers else None
+    ext = compressor.ext if compressor else "wav"
+    started = {}
+    latencies = []
+    futures = []
+
+    def iter_jobs():
+        for sentence in make_texts(args.items, args.duplicates, args.min_moras, args.max_moras, rng):
+            for speaker_id in args.speaker_ids:
+                job = TtsJob(
+                    speaker=speaker_id,
+                    text=sentence,
+                    output=work_dir / f"{make_file_id(sentence, speaker_id, {})}_speaker{speaker_id}.{ext}",
+                )
+                started[id(job)] = time.perf_counter()
+                yield job
+
+    def write(job):
+        if pool is not None:
+            job.future = pool.submit(data=job.wav, out_file=job.output, overwrite=True, use_ffmpeg_optimized=True)
+        else:
+            save_audio(job.wav, job.output, compressor)
+
+    if args.mode == "pipeline":
+        jobs = TtsPipeline(engine, writer=write).run(iter_jobs())
+    elif args.mode == "batch":
+        jobs = iter_batched_jobs(engine, iter_jobs(), args.batch_size)
+    else:
+        jobs = iter_jobs()
+
+    errors = 0
+    for job in jobs:
+        if args.mode != "pipeline":
+            if job.wav is None:
+                job.wav = engine.tts(speaker=job.speaker, text=job.text)
+            write(job)
+        start = started.pop(id(job))
+        if job.future is not None:
+            futures.append((start, job.future))
+        else:
+            latencies.append(time.perf_counter() - start)
+        errors += job.error is not None
+        job.wav = None
+    for start, future in futures:
+        future.result()
+        latencies.append(time.perf_counter() - start)
+    if pool is not None:
+        pool.shutdown()
+    return {"items": args.items * len(args.speaker_ids), "errors": errors, "latencies": latencies}
+
+
+def run_anki(args, base_url, work_dir, rng):
+    """Build a vocabulary deck set like the anki script: plan, batch synthesize, compress, package."""
+    import genanki
+    from AnkiBuilder import AnkiBuilder
+
+    compressor = make_compressor(args)
+    engine = VoicevoxEngine(base_url, device="cpu", output_profile=compressor.output_profile())
+    pool = CompressorPool(compressor, workers=args.compress_workers or None)
+    words = make_texts(args.items, 0, args.min_moras, args.max_moras, rng)
+    # decks overlap by `duplicates`, like N1 and オノマトペ
+    decks = [
+        words[i::4] + rng.sample(words, int(len(words) / 4 * args.duplicates))
+        for i in range(4)
+    ]
+
+    planner = SynthesisPlanner()
+    for idx, deck_words in enumerate(decks):
+        for word in deck_words:
+            for speaker_id in args.speaker_ids:
+                planner.add(word, speaker_id, target=idx)
+    jobs = list(planner)
+    files = {}
+    futures = []
+    for speaker_id in args.speaker_ids:
+        texts = [job.text for job in jobs if job.speaker == speaker_id]
+        for i in range(0, len(texts), args.batch_size):
+            batch = texts[i : i + args.batch_size]
+            start = time.perf_counter()
+            wavs = engine.tts_batch(speaker_id, batch)
+            for text, wav in zip(batch, wavs):
+                out_file = work_dir / f"{len(files):06d}_{speaker_id}.{compressor.ext}"
+                files[(text, speaker_id)] = out_file
+                futures.append((start, pool.submit(data=wav, out_file=out_file, use_ffmpeg_optimized=True)))
+    latencies = []
+    for start, future in futures:
+        # from the start of the batch until the clip is encoded
+        future.result()
+        latencies.append(time.perf_counter() - start)
+    pool.shutdown()
+
+    model = genanki.Model(1607362319, "Benchmark", fields=[{"name": "Front"}, {"name": "Back"}],
+                          templates=[{"name": "Card 1", "qfmt": "{{Front}}", "afmt": "{{Back}}"}])
+    builder = AnkiBuilder(work_dir / "benchmark.apkg", model)
+    start = time.perf_counter()
+    for idx, deck_words in enumerate(decks):
+        builder.add_deck(2059400510 + idx, f"Benchmark::{idx}", AnkiBuilder.fingerprint(deck_words))
+        for word in deck_words:
+            media = [files[(word, speaker_id)] for speaker_id in args.speaker_ids]
+            sounds = "".join(f"[sound:{path.name}]" for path in media)
+            builder.add_note(2059400510 + idx, fields=[sounds, f"<h1>{word}</h1><br>{sounds}"], media=media)
+    builder.write()
+    return {
+        "items": len(jobs),
+        "errors": 0,
+        "latencies": latencies,
+        "planner": planner.stats(),
+        "package_seconds": time.perf_counter() - start,
+    }
+
+
+def run_compress(args, base_url, work_dir, rng):
+    """Encode stub clips of random length with Compressor or CompressorPool."""
+    compressor = make_compressor(args)
+    stub = stub_server.StubEngine()
+    wavs = [
+        stub.wav(rng.randint(args.min_moras, args.max_moras), rate=compressor.sample_rate)
+        for _ in range(args.items)
+    ]
+    latencies = []
+    if args.compress_workers:
+        with CompressorPool(compressor, workers=args.compress_workers) as pool:
+            futures = []
+            for idx, wav in enumerate(wavs):
+                futures.append((time.perf_counter(), pool.submit(data=wav, out_file=work_dir / f"{idx}.{compressor.ext}")))
+            for start, future in futures:
+                future.result()
+                latencies.append(time.perf_counter() - start)
+    else:
+        for idx, wav in enumerate(wavs):
+            start = time.perf_counter()
+            compressor.compress(data=wav, out_file=work_dir / f"{idx}.{compressor.ext}", use_ffmpeg_optimized=True)
+            latencies.append(time.perf_counter() - start)
+    return {
+        "items": len(wavs),
+        "errors": 0,
+        "latencies": latencies,
+        "input_bytes": sum(len(wav) for wav in wavs),
+        "output_bytes": sum(path.stat().st_size for path in work_dir.iterdir()),
+    }
+
+
+def run_scenario(name, args, result_queue):
+    rng = random.Random(args.seed)
+    latency = {"/audio_query": "lognormal:0.01,0.3", "/synthesis": "lognormal:0.03,0.4"}
+    latency.update(item.split("=", 1) for item in args.latency)
+    parent, child = multiprocessing.Pipe()
+    stub = multiprocessing.Process(target=_serve_stub, args=(child, latency, args.latency_per_mora), daemon=True)
+    stub.start()
+    base_url = f"http://127.0.0.1:{parent.recv()}"
+    with tempfile.TemporaryDirectory(prefix=f"voicevox_bench_{name}_") as work_dir:
+        start = time.perf_counter()
+        result = globals()[f"run_{name}"](args, base_url, Path(work_dir), rng)
+        seconds = time.perf_counter() - start
+    parent.send("stop")
+    stub_calls = parent.recv()
+    stub.join()
+    latencies = result.pop("latencies")
+    result_queue.put(
+        {
+            "scenario": name,
+            **result,
+            "seconds": seconds,
+            "items_per_sec": result["items"] / seconds if seconds else None,
+            "latency": percentiles(latencies),
+            "peak_rss_mb": peak_rss_mb(),
+            "stub_calls": stub_calls,
+        }
+    )
+
+
+def main(args):
+    report = {"config": vars(args), "results": []}
+    for name in args.scenario:
+        # a fresh process per scenario, so peak rss is not shared
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_scenario, args=(name, args, queue))
+        process.start()
+        while True:
+            try:
+                report["results"].append(queue.get(timeout=1))
+                break
+            except Empty:
+                if not process.is_alive():
+                    raise Exception(f"scenario {name} failed, exit code {process.exitcode}")
+        process.join()
+        print(
+            f"{name}: {report['results'][-1]['items_per_sec']:.1f} items/s",
+            file=sys.stderr,
+        )
+    data = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(data, encoding="utf-8")
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main(get_args())
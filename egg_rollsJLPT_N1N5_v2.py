@@ -1,6 +1,6 @@
 import sqlite3
-import re
 from pathlib import Path
+from SynthesisPlanner import normalize_word
 
 if __name__ == "__main__":
     ROOT = Path(__file__).parent.resolve()
@@ -15,13 +15,7 @@ if __name__ == "__main__":
 
     for tag, sfld in data:
         tags = [t.split("::")[1] for t in tag.strip().split(" ")]
-        if sfld.startswith("〜"):
-            sfld = sfld[1:]
-        if sfld.endswith("〜"):
-            sfld = sfld[:-1]
-        sfld = re.sub(r"\[.*?\]", "", sfld)
-        sfld = re.sub(r"\(.*?\)", "", sfld)
-        sfld = sfld.replace("　", "").replace(" ", "")
+        sfld = normalize_word(sfld)
         for idx, target_tag in enumerate(target_tags):
             if target_tag in tags:
                 words[idx].append(sfld)
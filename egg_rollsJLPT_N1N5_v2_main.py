@@ -4,8 +4,17 @@ from pathlib import Path
 from tqdm import tqdm
 from pprint import pprint
 import genanki
-import json
 from Compressor import Compressor
+from CompressorPool import CompressorPool
+from SynthesisCache import SynthesisCache
+from QueryStore import QueryStore
+from SpeakerCache import SpeakerCache
+from AnkiBuilder import AnkiBuilder
+from WordCache import WordCache
+from SynthesisPlanner import SynthesisPlanner, normalize_word
+from Metrics import METRICS
+from Tracer import TRACER
+from Profiler import Profiler
 
 
 def get_args():
@@ -29,6 +38,35 @@ def get_args():
         default="output",
         help="output directory",
     )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="",
+        help="directory of the synthesis cache, disabled if not specified",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=1024,
+        help="size budget of the synthesis cache in MB",
+    )
+    parser.add_argument(
+        "--query_store",
+        type=str,
+        default="",
+        help="sqlite file to store audio_query results in, disabled if not specified",
+    )
+    parser.add_argument(
+        "--speaker_cache_ttl",
+        type=int,
+        default=24 * 60 * 60,
+        help="seconds to reuse speaker metadata cached on disk, 0 to disable the cache",
+    )
+    parser.add_argument(
+        "--refresh_speakers",
+        action="store_true",
+        help="refetch speaker metadata from the engine",
+    )
     parser.add_argument(
         "--speaker_name",
         type=str,
@@ -69,6 +107,63 @@ def get_args():
         action="store_true",
         help="query speaker info only",
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=32,
+        help="number of words per /multi_synthesis call, 1 to synthesize one by one",
+    )
+    parser.add_argument(
+        "--compress_workers",
+        type=int,
+        default=0,
+        help="number of compressor processes (default: cpu count)",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=0,
+        help="serve prometheus metrics on http://127.0.0.1:<port>/metrics (and /metrics.json), 0 to disable",
+    )
+    parser.add_argument(
+        "--metrics_file",
+        type=str,
+        default="",
+        help="json file rewritten with a metrics snapshot every --metrics_interval seconds",
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        type=float,
+        default=5.0,
+        help="seconds between metrics snapshots",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default="",
+        help="write a chrome trace (chrome://tracing, ui.perfetto.dev) of the synthesis, write, "
+        "compression and note spans of every word to this json file",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        choices=["cpu", "mem"],
+        help="profile synthesis, compression and packaging with cProfile (cpu) or tracemalloc (mem) and "
+        "write ranked reports to <profile_output>.<mode>.txt, per word costs to <profile_output>.<mode>.entries.csv",
+    )
+    parser.add_argument(
+        "--profile_output",
+        type=str,
+        default="profile",
+        help="prefix of the --profile report files",
+    )
+    parser.add_argument(
+        "--apkg",
+        type=str,
+        default="jlpt_cards.apkg",
+        help="anki package to write, decks unchanged since the last run are reused",
+    )
     parser.add_argument(
         "--model_id",
         type=int,
@@ -107,47 +202,30 @@ def print_speaker_styles(speaker_styles):
         print()
 
 
-class WordCache:
-    def __init__(self, path):
-        self.path = Path(path)
-        self.cache = {}
-        self.count = -1
-        self.just_long = 6
-        self.init()
-
-    def init(self):
-        if self.path.is_file():
-            with open(self.path, "r") as f:
-                data = json.load(f)
-                self.cache = data["cache"]
-                self.count = data["count"]
-
-    def get_id(self, key):
-        if key not in self.cache:
-            self.count += 1
-            self.cache[key] = str(self.count).rjust(self.just_long, "0")
-        return self.cache[key]
-
-    def to_dict(self):
-        return {"cache": self.cache, "count": self.count}
-
-    def __str__(self):
-        return json.dumps(self.to_dict(), indent=4, ensure_ascii=False)
-
-    def __repr__(self):
-        return self.__str__()
-
-    def save(self):
-        with open(self.path, "w") as f:
-            json.dump(self.to_dict(), f, indent=4, ensure_ascii=False)
-
-
 def main(args, params_hook):
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+        print(f"metrics: http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.metrics_file:
+        METRICS.start_snapshots(args.metrics_file, args.metrics_interval)
+    # before the compressor pool starts, its workers trace too
+    TRACER.enable(bool(args.trace))
     # init voicevox engine
-    engine = VoicevoxEngine(base_url=args.base_url)
+    cache = None
+    if args.cache_dir:
+        cache = SynthesisCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+    query_store = QueryStore(args.query_store) if args.query_store else None
+    speaker_cache = SpeakerCache(ttl=args.speaker_cache_ttl) if args.speaker_cache_ttl > 0 else None
+    engine = VoicevoxEngine(
+        base_url=args.base_url,
+        cache=cache,
+        query_store=query_store,
+        speaker_cache=speaker_cache,
+    )
+    if args.refresh_speakers:
+        engine.refresh_speaker()
     # get args
     cache_dir = Path(args.out_dir)
-    word_cache_file = cache_dir / "words.json"
     txt_dir = Path(args.txt_dir)
     assert txt_dir.is_dir(), "txt_dir is not found"
     cache_dir.mkdir(parents=True, exist_ok=True)
@@ -200,7 +278,8 @@ def main(args, params_hook):
     # 创建一个模型
     model_id = args.model_id
     deck_id = args.deck_id
-    word_cache = WordCache(word_cache_file)
+    # ids of words.json are imported on the first run
+    word_cache = WordCache(cache_dir / "words.db", migrate_from=cache_dir / "words.json")
 
     target_tags = [
         "N5",
@@ -227,13 +306,12 @@ def main(args, params_hook):
             },
         ],
     )
-    decks = [
-        genanki.Deck(deck_id + idx, f"JLPT単語::{tag}")
-        for idx, tag in enumerate(target_tags)
-    ]
-    media_files = []
+    builder = AnkiBuilder(args.apkg, model)
 
-    compressor = Compressor()
+    compressor = CompressorPool(Compressor(), workers=args.compress_workers or None)
+    # render at the compressor's rate and channels, the encoder skips resampling
+    engine.output_profile = compressor.compressor.output_profile()
+    compress_jobs = []
 
     for speaker_id in speaker_ids:
         engine.speaker_init(
@@ -244,60 +322,136 @@ def main(args, params_hook):
     a_ctx = """[sound:%s]""" * len(speaker_ids)
     b_ctx = """<h1>%s</h1><br>"""
 
-    for idx, target_tag in enumerate(
-        tqdm(
-            target_tags,
-            desc="generate anki tag",
-        )
-    ):
-        deck = decks[idx]
-        words = []
+    profiler = Profiler(args.profile, args.profile_output)
+    profiler.start()
+
+    # plan: read every deck first, each (word, speaker) is synthesized once
+    planner = SynthesisPlanner(normalize=normalize_word)
+    deck_words = []
+    for idx, target_tag in enumerate(target_tags):
         with open(
             txt_dir / f"{target_tag}.txt",
             "r",
             encoding="utf-8",
         ) as f:
             words = f.read().strip().split("\n")
-            for word in tqdm(
-                words,
-                desc="generate anki words",
+        fingerprint = AnkiBuilder.fingerprint(
+            words=words,
+            tag=target_tag,
+            speaker_ids=speaker_ids,
+            params_hook={str(i): params_hook[i] for i in speaker_ids},
+            compressor=vars(compressor.compressor),
+        )
+        if not builder.add_deck(deck_id + idx, f"JLPT単語::{target_tag}", fingerprint):
+            # same words and settings as the last run
+            continue
+        deck_words.append((idx, target_tag, words))
+        for word in words:
+            for speaker_id in speaker_ids:
+                planner.add(word, speaker_id, params_hook[speaker_id], target=target_tag)
+    print(f"plan: {planner.report()}")
+
+    def wav_path(text, speaker_id):
+        # keyed on the raw word like before, so the wavs of earlier runs are reused
+        return cache_dir / f"{word_cache.get_id(text)}_{speaker_id}.wav"
+
+    # allocate the ids of new words in one short transaction
+    word_cache.get_ids(job.text for job in planner)
+
+    # synthesize the missing wavs of the unique jobs
+    missing = [job for job in planner if not wav_path(job.text, job.speaker).is_file()]
+    METRICS.set_total(len(missing))
+    for speaker_id in speaker_ids:
+        texts = [job.text for job in missing if job.speaker == speaker_id]
+        if args.batch_size > 1:
+            for i in tqdm(
+                range(0, len(texts), args.batch_size),
+                desc=f"synthesize batches of speaker {speaker_id}",
                 leave=False,
             ):
-                file_name = word_cache.get_id(word)
-                resources = []
-                for speaker_id in speaker_ids:
-                    file_path = cache_dir / f"{file_name}_{speaker_id}.wav"
-                    cfile_path = cache_dir / f"{file_path.stem}.mp3"
-                    if not file_path.is_file():
-                        engine.tts(
-                            speaker=speaker_id,
-                            text=word,
-                            params_hook=params_hook[speaker_id],
-                            output=file_path,
-                        )
-                    assert file_path.is_file(), "file generates error"
-                    if not cfile_path.is_file():
-                        compressor.compress(file_path, cfile_path)
-                    assert cfile_path.is_file(), "compressed file generates error"
-                    resources.append(cfile_path.name)
-                    media_files.append(cfile_path.__str__())
-                resources = tuple(resources)
-                a = a_ctx % resources
-                b = b_ctx % word + a
-                note = genanki.Note(
-                    model=model,
+                batch = texts[i : i + args.batch_size]
+                with TRACER.tags(speaker=speaker_id):
+                    wavs = engine.tts_batch(
+                        speaker=speaker_id,
+                        texts=batch,
+                        params_hook=params_hook[speaker_id],
+                    )
+                with METRICS.time("file_write_seconds", format="wav"):
+                    for word, wav in zip(batch, wavs):
+                        with TRACER.span("file_write", format="wav", speaker=speaker_id, text_len=len(word)):
+                            with open(wav_path(word, speaker_id), "wb") as wf:
+                                wf.write(wav)
+                METRICS.item_done(len(batch))
+                profiler.entry_done(f"speaker {speaker_id} batch of {len(batch)} from {batch[0]}")
+        else:
+            for word in tqdm(texts, desc=f"synthesize speaker {speaker_id}", leave=False):
+                with TRACER.tags(speaker=speaker_id, text_len=len(word)):
+                    engine.tts(
+                        speaker=speaker_id,
+                        text=word,
+                        params_hook=params_hook[speaker_id],
+                        output=wav_path(word, speaker_id),
+                    )
+                METRICS.item_done()
+                profiler.entry_done(f"speaker {speaker_id} {word}")
+
+    # compress every unique wav once
+    for job in planner:
+        file_path = wav_path(job.text, job.speaker)
+        assert file_path.is_file(), "file generates error"
+        cfile_path = cache_dir / f"{file_path.stem}.{compressor.compressor.ext}"
+        if not cfile_path.is_file():
+            with TRACER.tags(speaker=job.speaker, text_len=len(job.text)):
+                compress_jobs.append(compressor.submit(in_file=file_path, out_file=cfile_path))
+
+    # fan the files out to the notes of every deck
+    for idx, target_tag, words in tqdm(deck_words, desc="generate anki tag"):
+        for word in words:
+            media = []
+            for speaker_id in speaker_ids:
+                # spellings of a word share the file of the one planned first
+                job = planner.get(word, speaker_id, params_hook[speaker_id])
+                stem = wav_path(job.text, speaker_id).stem
+                media.append(cache_dir / f"{stem}.{compressor.compressor.ext}")
+            resources = tuple(path.name for path in media)
+            a = a_ctx % resources
+            b = b_ctx % word + a
+            with TRACER.span("anki_note", deck=target_tag, text_len=len(word)):
+                builder.add_note(
+                    deck_id + idx,
                     fields=[
                         a,
                         b,
                     ],
                     tags=[target_tag],
+                    media=media,
                 )
-                deck.add_note(note)
-        word_cache.save()
+        profiler.entry_done(f"notes of {target_tag}")
+    # wait for the background compression, errors are raised here
+    for job in tqdm(compress_jobs, desc="compress", leave=False):
+        assert Path(job.result()).is_file(), "compressed file generates error"
+    compressor.shutdown()
+    word_cache.close()
+    METRICS.stop()
     # 生成APKG文件
-    my_package = genanki.Package(decks)
-    my_package.media_files = media_files
-    my_package.write_to_file("jlpt_cards.apkg")
+    rebuilt = sorted(builder.decks[i]["name"] for i in builder.changed)
+    with TRACER.span("anki_package"):
+        written = builder.write()
+    profiler.entry_done("package")
+    profiler.stop()
+    if args.profile:
+        print(f"profile report: {profiler.write()}")
+    if args.trace:
+        print(f"trace: {TRACER.write(args.trace)} span(s) written to {args.trace}")
+    if written:
+        print(f"{args.apkg} written, rebuilt decks: {rebuilt}")
+    else:
+        print(f"{args.apkg} is up to date")
+    if cache is not None:
+        print(f"synthesis cache: {cache}")
+    if query_store is not None:
+        print(f"query store: {query_store}")
+        query_store.close()
 
 
 if __name__ == "__main__":
@@ -7,17 +7,20 @@ from tqdm import tqdm
 from VoicevoxEngine import VoicevoxEngine
 from Compressor import Compressor
 import json
+import io
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import wave
+import argparse
 import genanki
 
 _SPEAKER_IDS = [13, 23]
 _COMPRESSOR = Compressor()
 
-# init voicevox engine
-_ENGINE = VoicevoxEngine("http://127.0.0.1:9817")
-for speaker_id in _SPEAKER_IDS:
-    _ENGINE.speaker_init(
-        speaker=speaker_id,
-    )
+# init voicevox engine, no request is sent until it is used
+_ENGINE = VoicevoxEngine(
+    "http://127.0.0.1:9817", output_profile=_COMPRESSOR.output_profile()
+)
 with open("params_hook.json", "r", encoding="utf-8") as f:
     _params_hook = json.load(f)
 
@@ -29,7 +32,8 @@ def line_handle(line):
     return line.strip()
 
 
-def post_handle(text, count):
+def parse_kaiwa(text):
+    """Split the text of a page into the (a, b) lines of its dialogue."""
     results = text.split("Ａ：")
     target = results[1]
     a, b = target.split("Ｂ：")
@@ -50,56 +54,169 @@ def post_handle(text, count):
             )
         )[::2]
     )
-    a = a.strip()
-    b = b.strip()
+    return a.strip(), b.strip()
+
 
+def post_handle(text, count):
+    a, b = parse_kaiwa(text)
     return Kaiwa(count, a, b)
 
 
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _extract_pages(pdf_path, pages):
+    """Worker: parse the dialogue of each page, the pdf is opened once per chunk."""
+    import pdfplumber
+
+    with pdfplumber.open(pdf_path) as pdf:
+        return [(idx, *parse_kaiwa(pdf.pages[idx].extract_text())) for idx in pages]
+
+
+def extract_dialogues(pdf_path, page_index, cache_path=None, workers=None):
+    """
+    Return the (a, b) lines of every page in `page_index`, in order.
+
+    Parsed pages are cached in the json file `cache_path` keyed by the pdf's
+    sha256 and the page number, pages missing from it are extracted in a
+    process pool with one chunk of pages per worker.
+    """
+    pdf_path = Path(pdf_path)
+    cache_path = Path(cache_path or pdf_path.with_suffix(".kaiwa.json"))
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+    sha = file_sha256(pdf_path)
+    pages = cache.setdefault(sha, {})
+
+    missing = [idx for idx in page_index if str(idx) not in pages]
+    if missing:
+        workers = min(workers or os.cpu_count() or 1, len(missing))
+        chunks = [missing[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for results in executor.map(_extract_pages, [str(pdf_path)] * workers, chunks):
+                for idx, a, b in results:
+                    pages[str(idx)] = [a, b]
+        temp = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(temp, cache_path)
+
+    return [tuple(pages[str(idx)]) for idx in page_index]
+
+
 class Kaiwa:
     def __init__(self, hash, a, b, speaker_ids=(13, 23)):
         self.hash = str(hash).rjust(8, "0")
         self.a = a
         self.b = b
-        self.wav_a = {}
-        self.wav_b = {}
         self.speaker_ids = speaker_ids
-        self.init_wav()
-
-    def init_wav(self):
-        for speaker_id in self.speaker_ids:
-            self.wav_b[speaker_id] = _ENGINE.tts(
-                speaker=speaker_id,
-                text=self.b,
-                params_hook=(
-                    _params_hook[str(speaker_id)] if speaker_id in _params_hook else {}
-                ),
-            )
-            self.wav_a[speaker_id] = _ENGINE.tts(
-                speaker=speaker_id,
-                text=self.a,
-                params_hook=(
-                    _params_hook[str(speaker_id)] if speaker_id in _params_hook else {}
-                ),
-            )
 
-    def to_mp3(self, output_dir):
+    def pairs(self):
+        """(speaker of a, speaker of b) of every dialogue, each speaker says both lines once."""
+        ids = list(self.speaker_ids)
+        return list(zip(ids, ids[1:] + ids[:1]))
+
+    def file_name(self, speaker_id, line):
+        return f"{self.hash}_{speaker_id}_{line}.{_COMPRESSOR.ext}"
+
+    def dialogue_name(self, speaker_a, speaker_b):
+        return f"{self.hash}_{speaker_a}_{speaker_b}_ab.{_COMPRESSOR.ext}"
+
+    def tts(self, speaker_id, text):
+        return _ENGINE.tts(
+            speaker=speaker_id,
+            text=text,
+            params_hook=(
+                _params_hook[str(speaker_id)] if str(speaker_id) in _params_hook else {}
+            ),
+        )
+
+    def render(self, output_dir, dialogue_gap=None):
+        """
+        Synthesize every line and stream it straight to the encoder, only the
+        wav of the current line is held in memory.
+
+        With `dialogue_gap` (seconds) the lines of each speaker pair are also
+        streamed as raw pcm into one A/B track with that much silence between
+        them.
+        """
         output_dir = Path(output_dir)
-        for speaker_id in self.speaker_ids:
-            wav_a = self.wav_a[speaker_id]
-            wav_b = self.wav_b[speaker_id]
-            Compressor().compress(
-                data=wav_a,
-                out_file=f"{output_dir}/{self.hash}_{speaker_id}_a.mp3",
-            )
-            Compressor().compress(
-                data=wav_b,
-                out_file=f"{output_dir}/{self.hash}_{speaker_id}_b.mp3",
-            )
+        for speaker_a, speaker_b in self.pairs():
+            lines = [(speaker_a, "a", self.a), (speaker_b, "b", self.b)]
+            track = None
+            try:
+                for idx, (speaker_id, line, text) in enumerate(lines):
+                    wav = self.tts(speaker_id, text)
+                    _COMPRESSOR.compress(
+                        data=wav,
+                        out_file=output_dir / self.file_name(speaker_id, line),
+                        overwrite=True,
+                        use_ffmpeg_optimized=True,
+                    )
+                    if dialogue_gap is None:
+                        continue
+                    if track is None:
+                        with wave.open(io.BytesIO(wav), "rb") as f:
+                            track = _COMPRESSOR.open_stream(
+                                output_dir / self.dialogue_name(speaker_a, speaker_b),
+                                f.getframerate(),
+                                f.getnchannels(),
+                                f.getsampwidth(),
+                            )
+                    if idx:
+                        track.write_silence(dialogue_gap)
+                    track.write_wav(wav)
+                    del wav
+            except BaseException:
+                if track is not None:
+                    track.abort()
+                raise
+            if track is not None:
+                track.close()
 
 
 if __name__ == "__main__":
-    import pdfplumber
+    ROOT = Path(__file__).parent.resolve()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--pdf",
+        type=str,
+        default=str(ROOT / "pdf" / "hanaseru300.pdf"),
+        help="path of the hanaseru300 pdf",
+    )
+    parser.add_argument(
+        "--kaiwa_cache",
+        type=str,
+        default=None,
+        help="json cache of the parsed dialogues (default: <pdf>.kaiwa.json)",
+    )
+    parser.add_argument(
+        "--extract_workers",
+        type=int,
+        default=0,
+        help="processes parsing pdf pages (default: cpu count)",
+    )
+    parser.add_argument(
+        "--dialogue_gap",
+        type=float,
+        default=None,
+        help="also render one A/B dialogue track per speaker pair with this many seconds between the lines",
+    )
+    args = parser.parse_args()
+
+    for speaker_id in _SPEAKER_IDS:
+        _ENGINE.speaker_init(
+            speaker=speaker_id,
+        )
 
     page_list = [
         [16, 46],
@@ -109,9 +226,14 @@ if __name__ == "__main__":
     for i in page_list:
         page_index.extend(list(range(i[0], i[1])))
 
-    count = 0
+    # parse (or load the cached) dialogues before any synthesis
+    dialogues = extract_dialogues(
+        args.pdf,
+        page_index,
+        cache_path=args.kaiwa_cache,
+        workers=args.extract_workers or None,
+    )
 
-    ROOT = Path(__file__).parent.resolve()
     wav_dir = ROOT / "wav"
     wav_dir.mkdir(
         parents=True,
@@ -138,54 +260,26 @@ if __name__ == "__main__":
     media_files = []
     ctx = """%s<h1>%s</h1><br>[sound:%s]"""
 
-    with pdfplumber.open(ROOT / "pdf" / "hanaseru300.pdf") as pdf:
-        for idx in tqdm(page_index):
-            text = pdf.pages[idx].extract_text()
-            count += 1
-            kaiwa = post_handle(text, count)
-            kaiwa.to_mp3(wav_dir)
-            speaker_1 = _SPEAKER_IDS[0]
-            speaker_2 = _SPEAKER_IDS[1]
+    for count, (a, b) in enumerate(tqdm(dialogues), start=1):
+        kaiwa = Kaiwa(count, a, b)
+        kaiwa.render(wav_dir, dialogue_gap=args.dialogue_gap)
 
-            media_files.append(f"{wav_dir}/{kaiwa.hash}_{speaker_1}_a.mp3")
-            media_files.append(f"{wav_dir}/{kaiwa.hash}_{speaker_2}_b.mp3")
-            media_files.append(f"{wav_dir}/{kaiwa.hash}_{speaker_2}_a.mp3")
-            media_files.append(f"{wav_dir}/{kaiwa.hash}_{speaker_1}_b.mp3")
+        for speaker_a, speaker_b in kaiwa.pairs():
+            file_a = kaiwa.file_name(speaker_a, "a")
+            file_b = kaiwa.file_name(speaker_b, "b")
+            media_files.append(f"{wav_dir}/{file_a}")
+            media_files.append(f"{wav_dir}/{file_b}")
+            back = ctx % ("B: ", kaiwa.b, file_b)
+            if args.dialogue_gap is not None:
+                file_ab = kaiwa.dialogue_name(speaker_a, speaker_b)
+                media_files.append(f"{wav_dir}/{file_ab}")
+                back += f"<br>[sound:{file_ab}]"
 
             note = genanki.Note(
                 model=model,
                 fields=[
-                    ctx
-                    % (
-                        "A: ",
-                        kaiwa.a,
-                        f"{kaiwa.hash}_{speaker_1}_a.mp3",
-                    ),
-                    ctx
-                    % (
-                        "B: ",
-                        kaiwa.b,
-                        f"{kaiwa.hash}_{speaker_2}_b.mp3",
-                    ),
-                ],
-            )
-            deck.add_note(note)
-            
-            note = genanki.Note(
-                model=model,
-                fields=[
-                    ctx
-                    % (
-                        "A: ",
-                        kaiwa.a,
-                        f"{kaiwa.hash}_{speaker_2}_a.mp3",
-                    ),
-                    ctx
-                    % (
-                        "B: ",
-                        kaiwa.b,
-                        f"{kaiwa.hash}_{speaker_1}_b.mp3",
-                    ),
+                    ctx % ("A: ", kaiwa.a, file_a),
+                    back,
                 ],
             )
             deck.add_note(note)
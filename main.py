@@ -1,13 +1,25 @@
 import re
 import argparse
 from VoicevoxEngine import VoicevoxEngine
+from EnginePool import EnginePool
+from LongTextEngine import LongTextEngine
 from pathlib import Path
 from pprint import pprint
 import json
 from Compressor import Compressor
+from CompressorPool import CompressorPool
+from SynthesisCache import SynthesisCache
+from QueryStore import QueryStore
+from SpeakerCache import SpeakerCache
+from Pipeline import TtsJob, TtsPipeline, iter_batched_jobs
+from SynthesisPlanner import SynthesisPlanner, normalize_sentence
+from Metrics import METRICS
+from Tracer import TRACER
+from Profiler import Profiler
 from copy import deepcopy
-import uuid
+import hashlib
 import logging
+import threading
 
 def get_args():
     parser = argparse.ArgumentParser()
@@ -15,8 +27,21 @@ def get_args():
     parser.add_argument(
         "--base_url",
         type=str,
-        default="http://localhost:50021",
-        help="base url of Voicevox Engine",
+        action="append",
+        default=None,
+        help="base url of Voicevox Engine, specify multiple times to balance over several engines "
+        "(default: http://localhost:50021)",
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=3,
+        help="retries of idempotent engine requests with jittered backoff",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="duplicate requests running longer than the p95 latency on another engine (needs multiple --base_url)",
     )
     parser.add_argument(
         "--input",
@@ -36,6 +61,35 @@ def get_args():
         default="output_audio",
         help="output directory for audio files",
     )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="",
+        help="directory of the synthesis cache, disabled if not specified",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=1024,
+        help="size budget of the synthesis cache in MB",
+    )
+    parser.add_argument(
+        "--query_store",
+        type=str,
+        default="",
+        help="sqlite file to store audio_query results in, disabled if not specified",
+    )
+    parser.add_argument(
+        "--speaker_cache_ttl",
+        type=int,
+        default=24 * 60 * 60,
+        help="seconds to reuse speaker metadata cached on disk, 0 to disable the cache",
+    )
+    parser.add_argument(
+        "--refresh_speakers",
+        action="store_true",
+        help="refetch speaker metadata from the engine",
+    )
     parser.add_argument(
         "--speaker_name",
         type=str,
@@ -85,7 +139,14 @@ def get_args():
     parser.add_argument(
         "--compress",
         action="store_true",
-        help="compress audio files to mp3",
+        help="compress audio files (mp3 by default, see --compress_format)",
+    )
+    parser.add_argument(
+        "--compress_format",
+        type=str,
+        default="mp3",
+        choices=["mp3", "opus", "aac"],
+        help="encoder of --compress: mp3, opus (ogg, smallest for speech) or aac",
     )
     parser.add_argument(
         "--compress_quality",
@@ -100,6 +161,128 @@ def get_args():
         default=True,
         help="use ffmpeg with VBR for better compression (default: enabled)",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip entries recorded as finished in the checkpoint journal (<output>.journal) of the last run",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="parse the input lazily and append every finished entry to the output at once, "
+        "invalid lines are skipped without asking",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=0,
+        help="serve prometheus metrics on http://127.0.0.1:<port>/metrics (and /metrics.json), 0 to disable",
+    )
+    parser.add_argument(
+        "--metrics_file",
+        type=str,
+        default="",
+        help="json file rewritten with a metrics snapshot every --metrics_interval seconds",
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        type=float,
+        default=5.0,
+        help="seconds between metrics snapshots",
+    )
+    parser.add_argument(
+        "--long_text",
+        action="store_true",
+        help="split sentences over --max_moras at 。！？ and 、, synthesize the chunks concurrently "
+        "(over several engines with multiple --base_url) and join them into one audio file",
+    )
+    parser.add_argument(
+        "--max_moras",
+        type=int,
+        default=80,
+        help="estimated moras per chunk in --long_text mode",
+    )
+    parser.add_argument(
+        "--chunk_workers",
+        type=int,
+        default=4,
+        help="chunks synthesized at the same time in --long_text mode",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default="",
+        help="write a chrome trace (chrome://tracing, ui.perfetto.dev) of the audio_query, synthesis, "
+        "write and compression spans of every entry to this json file",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        choices=["cpu", "mem"],
+        help="profile the processing of the input with cProfile (cpu) or tracemalloc (mem) and "
+        "write ranked reports to <profile_output>.<mode>.txt, per entry costs to <profile_output>.<mode>.entries.csv",
+    )
+    parser.add_argument(
+        "--profile_output",
+        type=str,
+        default="profile",
+        help="prefix of the --profile report files",
+    )
+    parser.add_argument(
+        "--dedup_window",
+        type=int,
+        default=100000,
+        help="finished sentences remembered for deduplication in stream mode, older ones are "
+        "synthesized again when they come back (about 100 bytes each), 0 for no limit",
+    )
+    parser.add_argument(
+        "--flush_every",
+        type=int,
+        default=100,
+        help="flush the output jsonl every N entries in stream mode",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="send up to batch_size entries per /multi_synthesis call (ignored in pipeline mode)",
+    )
+    parser.add_argument(
+        "--compress_workers",
+        type=int,
+        default=0,
+        help="compress in N background processes while synthesis goes on, 0 to compress inline",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="overlap audio_query, synthesis and writing in a pipelined run",
+    )
+    parser.add_argument(
+        "--query_workers",
+        type=int,
+        default=2,
+        help="number of audio_query workers in pipeline mode",
+    )
+    parser.add_argument(
+        "--synthesis_workers",
+        type=int,
+        default=2,
+        help="number of synthesis workers in pipeline mode",
+    )
+    parser.add_argument(
+        "--writer_workers",
+        type=int,
+        default=2,
+        help="number of writer/compressor workers in pipeline mode",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=8,
+        help="capacity of the queues between pipeline stages",
+    )
 
     return parser.parse_args()
 
@@ -140,6 +323,94 @@ def validate_jsonl_file(file_path):
     return valid_lines, errors
 
 
+def iter_jsonl_file(file_path, errors, max_errors=100):
+    """Lazily yield (line_num, line, entry) of valid lines, invalid lines are counted in errors."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                errors["count"] += 1
+                if len(errors["samples"]) < max_errors:
+                    errors["samples"].append({
+                        "line_num": line_num,
+                        "error": f"Invalid JSON: {str(e)}",
+                        "content": line[:100] + "..." if len(line) > 100 else line
+                    })
+                continue
+            yield line_num, line, entry
+
+
+def count_lines(file_path):
+    count = 0
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            count += block.count(b"\n")
+    return count
+
+
+def make_file_id(sentence, speaker_id, params):
+    """Deterministic file id of one (sentence, speaker, params) synthesis."""
+    data = json.dumps([sentence, int(speaker_id), params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+
+def make_entry_key(line_num, line):
+    return f"{line_num}:{hashlib.sha1(line.encode('utf-8')).hexdigest()[:16]}"
+
+
+class Journal:
+    def __init__(self, path, resume=False):
+        """
+        Append-only checkpoint journal of finished entry keys, one per line.
+        Without `resume` the journal of the last run is discarded.
+        """
+        self.path = Path(path)
+        self.done = set()
+        if resume and self.path.is_file():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.done = {line.strip() for line in f if line.strip()}
+        self.file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def add(self, key):
+        with self.lock:
+            self.file.write(key + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class JsonlWriter:
+    def __init__(self, path, mode="w", flush_every=100):
+        """Thread safe jsonl appender flushing every `flush_every` entries."""
+        self.file = open(path, mode, encoding="utf-8")
+        self.flush_every = max(1, flush_every)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.count += 1
+            if self.count % self.flush_every == 0:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
 def print_speaker_styles(speaker_styles, logger=None):
     if logger is None:
         logger = setup_logging()
@@ -156,39 +427,31 @@ def print_speaker_styles(speaker_styles, logger=None):
         logger.info("")
 
 
-class WordCache:
-    def __init__(self, path):
-        self.path = Path(path)
-        self.cache = {}
-        self.count = -1
-        self.just_long = 6
-        self.init()
-
-    def init(self):
-        if self.path.is_file():
-            with open(self.path, "r") as f:
-                data = json.load(f)
-                self.cache = data["cache"]
-                self.count = data["count"]
-
-    def get_id(self, key):
-        if key not in self.cache:
-            self.count += 1
-            self.cache[key] = str(self.count).rjust(self.just_long, "0")
-        return self.cache[key]
-
-    def to_dict(self):
-        return {"cache": self.cache, "count": self.count}
+def log_endpoint_stats(stats, logger):
+    for endpoint, calls in stats.items():
+        logger.info(
+            f"     {endpoint}: {calls['calls']} call(s), "
+            f"{calls['retries']} retry(ies), {calls['errors']} error(s)"
+        )
 
-    def __str__(self):
-        return json.dumps(self.to_dict(), indent=4, ensure_ascii=False)
 
-    def __repr__(self):
-        return self.__str__()
+def save_audio(wav, file_path, compressor=None, use_ffmpeg=True):
+    """Write wav bytes to file_path, or pipe them through the compressor into file_path."""
+    file_path = Path(file_path)
+    if compressor is None:
+        with METRICS.time("file_write_seconds", format="wav"), TRACER.span("file_write", format="wav"):
+            with open(file_path, "wb") as f:
+                f.write(wav)
+        assert file_path.is_file(), f"Failed to generate audio file: {file_path}"
+        return
 
-    def save(self):
-        with open(self.path, "w") as f:
-            json.dump(self.to_dict(), f, indent=4, ensure_ascii=False)
+    compressor.compress(
+        data=wav,
+        out_file=file_path,
+        overwrite=True,
+        use_ffmpeg_optimized=use_ffmpeg,
+    )
+    assert file_path.is_file(), f"Failed to compress audio file: {file_path}"
 
 
 def main(args):
@@ -202,8 +465,36 @@ def main(args):
     
     # init voicevox engine
     logger.info("[1/5] Initializing Voicevox Engine...")
-    logger.info(f"     Base URL: {args.base_url}")
-    engine = VoicevoxEngine(base_url=args.base_url)
+    base_urls = args.base_url or ["http://localhost:50021"]
+    logger.info(f"     Base URL: {', '.join(base_urls)}")
+    cache = None
+    if args.cache_dir:
+        cache = SynthesisCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+        logger.info(f"     Synthesis cache: {Path(args.cache_dir).absolute()} ({args.cache_size} MB)")
+    query_store = None
+    if args.query_store:
+        query_store = QueryStore(args.query_store)
+        logger.info(f"     Query store: {Path(args.query_store).absolute()}")
+    speaker_cache = SpeakerCache(ttl=args.speaker_cache_ttl) if args.speaker_cache_ttl > 0 else None
+    if len(base_urls) > 1:
+        engine = EnginePool(
+            base_urls,
+            cache=cache,
+            query_store=query_store,
+            hedge=args.hedge,
+            max_retries=args.max_retries,
+            speaker_cache=speaker_cache,
+        )
+    else:
+        engine = VoicevoxEngine(
+            base_url=base_urls[0],
+            cache=cache,
+            query_store=query_store,
+            max_retries=args.max_retries,
+            speaker_cache=speaker_cache,
+        )
+    if args.refresh_speakers:
+        engine.refresh_speaker()
     logger.info("     ✓ Engine initialized successfully")
     logger.info("")
     
@@ -306,18 +597,15 @@ def main(args):
             try:
                 # Get speaker info from engine
                 speaker_info = None
-                for ss in engine.speakers:
-                    for style in ss.styles:
-                        if style.id == sid:
-                            speaker_info = {
-                                "name": ss.name,
-                                "uuid": ss.speaker_uuid,
-                                "style_name": style.name,
-                                "style_id": style.id
-                            }
-                            break
-                    if speaker_info:
-                        break
+                matched = engine.catalog.style(sid)
+                if matched:
+                    ss, style = matched
+                    speaker_info = {
+                        "name": ss.name,
+                        "uuid": ss.speaker_uuid,
+                        "style_name": style.name,
+                        "style_id": style.id
+                    }
                 
                 if speaker_info:
                     logger.info(f"       Speaker {sid}:")
@@ -337,115 +625,306 @@ def main(args):
         engine.speaker_init(speaker=speaker_id)
         logger.info(f"     ✓ Initialized speaker {speaker_id}")
     
-    compressor = Compressor() if args.compress else None
+    compressor = Compressor(out_fmt=args.compress_format) if args.compress else None
     
     # Set compression quality
     if compressor and args.compress:
         compressor.set_quality(args.compress_quality)
-        logger.info(f"     MP3 compression: Enabled ({args.compress_quality} quality)")
+        # render at the preset's rate and channels, the encoder skips resampling
+        engine.output_profile = compressor.output_profile()
+        logger.info(
+            f"     {args.compress_format.upper()} compression: Enabled "
+            f"({args.compress_quality} quality, {compressor.bitrate}, {compressor.sample_rate} Hz)"
+        )
         logger.info(f"     FFmpeg VBR: {'Enabled' if args.use_ffmpeg else 'Disabled (using pydub)'}")
+        if args.compress_workers > 0:
+            logger.info(f"     Compressor pool: {args.compress_workers} worker process(es)")
     else:
-        logger.info(f"     MP3 compression: Disabled")
+        logger.info(f"     Compression: Disabled")
     logger.info("")
+    if args.trace:
+        # before the compressor pool starts, its workers trace too
+        TRACER.enable()
+        logger.info(f"     Trace: {args.trace}")
+    compressor_pool = None
+    if compressor and args.compress_workers > 0:
+        compressor_pool = CompressorPool(compressor, workers=args.compress_workers)
+    # engine used for synthesis, the plain one keeps serving stats and speakers
+    tts_engine = engine
+    if args.long_text:
+        tts_engine = LongTextEngine(engine, max_moras=args.max_moras, workers=args.chunk_workers)
+        logger.info(
+            f"     Long text mode: chunks of up to {args.max_moras} mora(s), "
+            f"{args.chunk_workers} chunk(s) at a time"
+        )
+
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+        logger.info(f"     Metrics: http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.metrics_file:
+        METRICS.start_snapshots(args.metrics_file, args.metrics_interval)
+        logger.info(f"     Metrics snapshots: {args.metrics_file} every {args.metrics_interval}s")
+
+    profiler = Profiler(args.profile, args.profile_output)
+    if args.profile:
+        logger.info(f"     Profile: {args.profile}, reports in {args.profile_output}.{args.profile}.*")
+    profiler.start()
 
     # read and validate input jsonl
     logger.info("[5/5] Validating and processing input JSONL file...")
     logger.info(f"     File: {input_file.absolute()}")
-    valid_lines, errors = validate_jsonl_file(input_file)
-    
-    if errors:
-        logger.info("")
-        logger.info(f"     ⚠ Found {len(errors)} invalid line(s):")
-        for error in errors:
-            logger.info(f"       Line {error['line_num']}: {error['error']}")
-            logger.info(f"         Content: {error['content']}")
-        logger.info("")
-        
-        # Ask user if they want to continue
-        response = input("     Continue with valid lines only? (y/n): ")
-        if response.lower() != 'y':
-            logger.info("Processing cancelled.")
-            return
-        logger.info(f"     Continuing with {len(valid_lines)} valid line(s)...\n")
-    else:
-        logger.info(f"     ✓ JSONL file is valid ({len(valid_lines)} entries)\n")
-    
     output_data = []
-    total_entries = len(valid_lines)
-    
-    for idx, (line_num, line, entry) in enumerate(valid_lines, 1):
-        # Log progress in [completed/total] format
-        logger.info(f"[{idx}/{total_entries}] Processing entry at line {line_num}")
-        
-        # Check if sentence field exists
-        if "sentence" not in entry:
-            warning_msg = f"Warning: 'sentence' field not found at line {line_num}"
-            logger.info(warning_msg)
-            entry["_processing_error"] = warning_msg
-            output_data.append(entry)
-            continue
-        
-        sentence = entry["sentence"]
-        audio_files = []
-        
-        # Generate one UUID per sentence (not per speaker)
-        file_id = str(uuid.uuid4())[:8]
+    writer = None
+    if args.stream:
+        errors = {"count": 0, "samples": []}
+        valid_lines = iter_jsonl_file(input_file, errors)
+        line_count = count_lines(input_file)
+        total_entries = f"~{line_count}"
+        METRICS.set_total(line_count)
+        writer = JsonlWriter(output_file, "w", args.flush_every)
+        logger.info(f"     Streaming {total_entries} line(s), output is appended as entries finish\n")
+    else:
+        valid_lines, errors = validate_jsonl_file(input_file)
         
-        for speaker_id in speaker_ids:
-            # Use the same file_id for all speakers of the same sentence
-            file_ext = "mp3" if args.compress else "wav"
-            file_name = f"{file_id}_speaker{speaker_id}.{file_ext}"
-            file_path = out_dir / file_name
+        if errors:
+            logger.info("")
+            logger.info(f"     ⚠ Found {len(errors)} invalid line(s):")
+            for error in errors:
+                logger.info(f"       Line {error['line_num']}: {error['error']}")
+                logger.info(f"         Content: {error['content']}")
+            logger.info("")
             
-            # Generate TTS
-            logger.info(f"Generating audio by speaker_{speaker_id} for: {sentence[:50]}...")
-            engine.tts(
-                speaker=speaker_id,
-                text=sentence,
-                params_hook=(
-                    params_hook[str(speaker_id)]
-                    if str(speaker_id) in params_hook
-                    else {}
-                ),
-                output=file_path,
+            # Ask user if they want to continue
+            response = input("     Continue with valid lines only? (y/n): ")
+            if response.lower() != 'y':
+                profiler.stop()
+                logger.info("Processing cancelled.")
+                return
+            logger.info(f"     Continuing with {len(valid_lines)} valid line(s)...\n")
+        else:
+            logger.info(f"     ✓ JSONL file is valid ({len(valid_lines)} entries)\n")
+        total_entries = len(valid_lines)
+        METRICS.set_total(total_entries)
+
+    file_ext = compressor.ext if compressor else "wav"
+    journal = Journal(f"{output_file}.journal", resume=args.resume)
+    if args.resume:
+        logger.info(f"     Resuming, {len(journal.done)} finished entry(ies) in {journal.path}")
+    skipped = 0
+
+    # finished jobs are compacted to a digest, in --stream mode only the last
+    # --dedup_window of them are kept so memory stays flat
+    planner = SynthesisPlanner(
+        normalize=normalize_sentence,
+        compact=True,
+        max_finished=(args.dedup_window or None) if args.stream else None,
+    )
+
+    def finish_entry(entry):
+        if writer is not None:
+            writer.write(entry)
+        else:
+            output_data.append(entry)
+
+    def get_params_hook(speaker_id):
+        return params_hook[str(speaker_id)] if str(speaker_id) in params_hook else {}
+
+    def iter_jobs():
+        nonlocal skipped
+        for idx, (line_num, line, entry) in enumerate(valid_lines, 1):
+            # Check if sentence field exists
+            if "sentence" not in entry:
+                warning_msg = f"Warning: 'sentence' field not found at line {line_num}"
+                logger.info(warning_msg)
+                entry["_processing_error"] = warning_msg
+                finish_entry(entry)
+                METRICS.item_done()
+                continue
+
+            key = make_entry_key(line_num, line)
+            # duplicates of a sentence share one file, see planner, the
+            # normalized sentence is synthesized so they share its content too
+            sentence = normalize_sentence(entry["sentence"])
+            entry["audio_files"] = [
+                str(
+                    out_dir
+                    / f"{make_file_id(sentence, speaker_id, get_params_hook(speaker_id))}"
+                    f"_speaker{speaker_id}.{file_ext}"
+                )
+                for speaker_id in speaker_ids
+            ]
+            if key in journal:
+                # finished by the last run, the file names are deterministic
+                skipped += 1
+                finish_entry(entry)
+                METRICS.item_done()
+                continue
+            if writer is None:
+                # keep the input order in the output
+                output_data.append(entry)
+            state = {"pending": len(speaker_ids), "key": key}
+
+            for speaker_id, file_path in zip(speaker_ids, entry["audio_files"]):
+                target = (idx, line_num, entry, state)
+                planned, status = planner.add(
+                    sentence,
+                    speaker_id,
+                    get_params_hook(speaker_id),
+                    target=target,
+                )
+                if status == "new":
+                    yield TtsJob(
+                        speaker=speaker_id,
+                        text=sentence,
+                        params_hook=get_params_hook(speaker_id),
+                        output=Path(file_path),
+                        tag=planned,
+                    )
+                elif status == "done":
+                    # synthesized for an earlier entry
+                    target_done(target, speaker_id, Path(file_path), planned.error)
+
+    def write_audio(job):
+        if compressor_pool is not None:
+            # hand the clip off and keep synthesizing, see job_done
+            job.future = compressor_pool.submit(
+                data=job.wav,
+                out_file=job.output,
+                overwrite=True,
+                use_ffmpeg_optimized=args.use_ffmpeg,
             )
-            
-            assert file_path.is_file(), f"Failed to generate audio file: {file_path}"
-            
-            # Compress to mp3 if requested
-            if args.compress:
-                wav_file = file_path.with_suffix(".wav")
-                if wav_file.is_file():
-                    compressor.compress(
-                        in_file=wav_file,
-                        out_file=file_path,
-                        use_ffmpeg_optimized=args.use_ffmpeg
+            return
+        save_audio(job.wav, job.output, compressor, args.use_ffmpeg)
+
+    state_lock = threading.Lock()
+
+    def job_done(job):
+        # fan the result out to every entry waiting for this synthesis
+        for target in planner.finish(job.tag, job.error):
+            target_done(target, job.speaker, job.output, job.error)
+
+    def target_done(target, speaker_id, output, error):
+        idx, line_num, entry, state = target
+        if error is not None:
+            logger.info(f"[{idx}/{total_entries}] ✗ speaker_{speaker_id} failed at line {line_num}: {error}")
+            entry["_processing_error"] = str(error)
+        else:
+            logger.info(f"[{idx}/{total_entries}] Generated {output.name} for entry at line {line_num}")
+        with state_lock:
+            state["pending"] -= 1
+            if state["pending"] > 0:
+                return
+        METRICS.item_done()
+        profiler.entry_done(f"line {line_num}")
+        if "_processing_error" not in entry:
+            journal.add(state["key"])
+        if writer is not None:
+            finish_entry(entry)
+
+    def compressed(job, future):
+        job.error = future.exception()
+        job_done(job)
+
+    if args.pipeline:
+        logger.info(
+            f"     Pipeline mode: {args.query_workers} query / "
+            f"{args.synthesis_workers} synthesis / {args.writer_workers} writer worker(s)"
+        )
+        pipeline = TtsPipeline(
+            tts_engine,
+            writer=write_audio,
+            query_workers=args.query_workers,
+            synthesis_workers=args.synthesis_workers,
+            writer_workers=args.writer_workers,
+            queue_size=args.queue_size,
+        )
+        jobs = pipeline.run(iter_jobs())
+    elif args.batch_size > 1:
+        logger.info(f"     Batch mode: up to {args.batch_size} job(s) per /multi_synthesis call")
+        jobs = iter_batched_jobs(tts_engine, iter_jobs(), args.batch_size)
+    else:
+        jobs = iter_jobs()
+
+    for job in jobs:
+        if not args.pipeline:
+            with TRACER.tags(speaker=job.speaker, text_len=len(job.text)):
+                if job.wav is None:
+                    # Generate TTS
+                    logger.info(f"Generating audio by speaker_{job.speaker} for: {job.text[:50]}...")
+                    job.wav = tts_engine.tts(
+                        speaker=job.speaker,
+                        text=job.text,
+                        params_hook=job.params_hook,
                     )
-                    assert file_path.is_file(), f"Failed to compress audio file: {file_path}"
-                    # Remove wav file to save space
-                    try:
-                        wav_file.unlink()
-                    except Exception as e:
-                        logger.info(f"     ⚠  Could not remove temp WAV file: {e}")
-            
-            audio_files.append(str(file_path))
-        
-        # Add audio_files to the entry
-        entry["audio_files"] = audio_files
-        output_data.append(entry)
-        logger.info(f"[{idx}/{total_entries}] Generated {len(audio_files)} audio file(s) for entry\n")
-    
-    # write output jsonl
-    with open(output_file, "w", encoding="utf-8") as f:
-        for entry in output_data:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                write_audio(job)
+        if job.error is None and job.future is not None:
+            job.future.add_done_callback(lambda future, job=job: compressed(job, future))
+        else:
+            job_done(job)
+
+    if compressor_pool is not None:
+        compressor_pool.shutdown(wait=True)
+    if args.long_text:
+        tts_engine.close()
+    METRICS.stop()
+    if args.trace:
+        logger.info(f"     Trace: {TRACER.write(args.trace)} span(s) written to {args.trace}")
+    journal.close()
+    if writer is not None:
+        writer.close()
+        if errors["count"]:
+            logger.info(f"     ⚠ Skipped {errors['count']} invalid line(s):")
+            for error in errors["samples"]:
+                logger.info(f"       Line {error['line_num']}: {error['error']}")
+    else:
+        # write output jsonl
+        with open(output_file, "w", encoding="utf-8") as f:
+            for entry in output_data:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    profiler.stop()
+    if args.profile:
+        logger.info(f"     Profile report: {profiler.write()}")
     
     logger.info("="*60)
     logger.info("Processing Complete!")
     logger.info("="*60)
     logger.info(f"✓ Output written to: {output_file.absolute()}")
     logger.info(f"✓ Audio files saved to: {out_dir.absolute()}")
-    logger.info(f"✓ Total entries processed: {len(output_data)}")
+    logger.info(f"✓ Total entries processed: {writer.count if writer else len(output_data)}")
+    if skipped:
+        logger.info(f"✓ Entries skipped as finished by the last run: {skipped}")
+    logger.info(f"✓ Synthesis plan: {planner.report()}")
+    progress = METRICS.snapshot()["progress"]
+    logger.info(
+        f"✓ Throughput: {progress['done'] / max(progress['elapsed_seconds'], 1e-9):.2f} entries/s "
+        f"over {progress['elapsed_seconds']:.1f}s"
+    )
+    if cache is not None:
+        stats = cache.stats()
+        logger.info(
+            f"✓ Synthesis cache: {stats['hits']} hit(s), {stats['misses']} miss(es), "
+            f"{stats['evictions']} eviction(s), {stats['bytes'] / 1024 / 1024:.1f} MB used"
+        )
+    if query_store is not None:
+        stats = query_store.stats()
+        logger.info(f"✓ Query store: {stats['hits']} hit(s), {stats['misses']} miss(es)")
+        query_store.close()
+    if isinstance(engine, EnginePool):
+        stats = engine.stats()
+        for node in stats["nodes"]:
+            logger.info(
+                f"✓ Engine {node['base_url']}: {node['requests']} request(s), "
+                f"{node['failures']} failure(s)"
+            )
+            log_endpoint_stats(node["endpoints"], logger)
+        for method, calls in stats["calls"].items():
+            if calls["hedges"]:
+                logger.info(
+                    f"     {method}: {calls['hedges']} hedged of {calls['calls']} call(s), "
+                    f"{calls['hedge_wins']} won by the hedge"
+                )
+    else:
+        log_endpoint_stats(engine.stats(), logger)
     logger.info("="*60)
 
 
@@ -0,0 +1,288 @@
+import io
+import json
+import math
+import time
+import wave
+import random
+import zipfile
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+STUB_VERSION = "0.0.0-stub"
+
+STUB_SPEAKERS = [
+    {
+        "name": "四国めたん",
+        "speaker_uuid": "00000000-0000-0000-0000-000000000001",
+        "styles": [
+            {"name": "ノーマル", "id": 2, "type": "talk"},
+            {"name": "あまあま", "id": 0, "type": "talk"},
+        ],
+        "version": STUB_VERSION,
+        "supported_features": {"permitted_synthesis_morphing": "SELF_ONLY"},
+    },
+    {
+        "name": "春日部つむぎ",
+        "speaker_uuid": "00000000-0000-0000-0000-000000000002",
+        "styles": [{"name": "ノーマル", "id": 8, "type": "talk"}],
+        "version": STUB_VERSION,
+        "supported_features": {"permitted_synthesis_morphing": "SELF_ONLY"},
+    },
+    {
+        "name": "No.7",
+        "speaker_uuid": "00000000-0000-0000-0000-000000000003",
+        "styles": [{"name": "ノーマル", "id": 13, "type": "talk"}],
+        "version": STUB_VERSION,
+        "supported_features": {"permitted_synthesis_morphing": "ALL"},
+    },
+    {
+        "name": "WhiteCUL",
+        "speaker_uuid": "67d5d8da-acd7-4207-bb10-b5542d3a663b",
+        "styles": [{"name": "ノーマル", "id": 23, "type": "talk"}],
+        "version": STUB_VERSION,
+        "supported_features": {"permitted_synthesis_morphing": "ALL"},
+    },
+]
+
+
+def parse_latency(spec):
+    """
+    Latency distribution in seconds from a spec string:
+    "const:0.01", "uniform:0.01,0.05", "lognormal:<median>,<sigma>" or
+    "exp:<mean>".
+    """
+    kind, _, values = spec.partition(":")
+    args = [float(v) for v in values.split(",") if v]
+    if kind == "const":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(args[0]), args[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1.0 / args[0]) if args[0] > 0 else 0.0
+    raise ValueError(f"unknown latency distribution: {spec}")
+
+
+class StubEngine:
+    def __init__(
+        self,
+        latency=None,
+        latency_per_mora=0.0,
+        seconds_per_mora=0.12,
+        sampling_rate=24000,
+    ):
+        """
+        Behavior of the fake engine.
+
+        Args:
+            latency: {path: spec} latency distribution per endpoint, see
+                parse_latency, "default" applies to the other endpoints
+            latency_per_mora: extra seconds of /synthesis per mora
+            seconds_per_mora: audio length per mora, wav sizes grow with the text
+            sampling_rate: default outputSamplingRate of /audio_query
+        """
+        latency = {"default": "const:0", **(latency or {})}
+        self.latency = {path: parse_latency(spec) for path, spec in latency.items()}
+        self.latency_per_mora = latency_per_mora
+        self.seconds_per_mora = seconds_per_mora
+        self.sampling_rate = sampling_rate
+        self.counts = {}
+        self.lock = threading.Lock()
+        # one second of a noisy tone, clips are cut from it so encoders have
+        # something to compress
+        rng = random.Random(0)
+        self.tone = {}
+        self._tone_frames = [
+            int(6000 * math.sin(2 * math.pi * 220 * i / 48000) + rng.gauss(0, 800))
+            for i in range(48000)
+        ]
+
+    def delay(self, path, moras=0):
+        sample = self.latency.get(path, self.latency["default"])
+        time.sleep(max(0.0, sample()) + self.latency_per_mora * moras)
+
+    def count(self, path):
+        with self.lock:
+            self.counts[path] = self.counts.get(path, 0) + 1
+
+    def _pcm(self, rate, channels):
+        key = (rate, channels)
+        if key not in self.tone:
+            step = 48000 / rate
+            frames = bytearray()
+            for i in range(rate):
+                sample = max(-32768, min(32767, self._tone_frames[int(i * step)]))
+                frames += sample.to_bytes(2, "little", signed=True) * channels
+            self.tone[key] = bytes(frames)
+        return self.tone[key]
+
+    def wav(self, moras, rate=None, stereo=False):
+        rate = int(rate or self.sampling_rate)
+        channels = 2 if stereo else 1
+        frames = int(max(1, moras) * self.seconds_per_mora * rate)
+        second = self._pcm(rate, channels)
+        size = frames * 2 * channels
+        data = second * (size // len(second)) + second[: size % len(second)]
+        f = io.BytesIO()
+        with wave.open(f, "wb") as w:
+            w.setnchannels(channels)
+            w.setsampwidth(2)
+            w.setframerate(rate)
+            w.writeframes(data)
+        return f.getvalue()
+
+    def audio_query(self, text):
+        return {
+            "accent_phrases": [
+                {
+                    "moras": [{"text": c, "vowel": "a", "vowel_length": 0.1, "pitch": 5.0} for c in text],
+                    "accent": 1,
+                    "pause_mora": None,
+                    "is_interrogative": False,
+                }
+            ],
+            "speedScale": 1.0,
+            "pitchScale": 0.0,
+            "intonationScale": 1.0,
+            "volumeScale": 1.0,
+            "prePhonemeLength": 0.1,
+            "postPhonemeLength": 0.1,
+            "outputSamplingRate": self.sampling_rate,
+            "outputStereo": False,
+            "kana": text,
+        }
+
+    @staticmethod
+    def moras(query):
+        return sum(len(p["moras"]) for p in query["accent_phrases"])
+
+
+def make_handler(engine):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, code, body=b"", content_type="application/json"):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, data):
+            self.send(200, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+        def handle_request(self):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            path = url.path
+            engine.count(path)
+
+            if path == "/version":
+                engine.delay(path)
+                return self.send_json(STUB_VERSION)
+            if path == "/supported_devices":
+                engine.delay(path)
+                return self.send_json({"cpu": True, "cuda": True, "dml": False})
+            if path == "/speakers":
+                engine.delay(path)
+                return self.send_json(STUB_SPEAKERS)
+            if path in ("/initialize_speaker", "/is_initialized_speaker"):
+                engine.delay(path)
+                if path == "/is_initialized_speaker":
+                    return self.send_json(True)
+                return self.send(204)
+            if path == "/audio_query":
+                if "text" not in query or "speaker" not in query:
+                    return self.send(422, b'{"detail": "text and speaker are required"}')
+                engine.delay(path)
+                return self.send_json(engine.audio_query(query["text"]))
+            if path == "/synthesis":
+                params = json.loads(body)
+                moras = engine.moras(params)
+                engine.delay(path, moras)
+                return self.send(
+                    200,
+                    engine.wav(moras, params.get("outputSamplingRate"), params.get("outputStereo")),
+                    "audio/wav",
+                )
+            if path == "/multi_synthesis":
+                queries = json.loads(body)
+                engine.delay(path, sum(engine.moras(q) for q in queries))
+                f = io.BytesIO()
+                with zipfile.ZipFile(f, "w") as z:
+                    for idx, params in enumerate(queries, 1):
+                        z.writestr(
+                            f"{idx:03d}.wav",
+                            engine.wav(
+                                engine.moras(params),
+                                params.get("outputSamplingRate"),
+                                params.get("outputStereo"),
+                            ),
+                        )
+                return self.send(200, f.getvalue(), "application/zip")
+            return self.send(404, b'{"detail": "Not Found"}')
+
+        do_GET = handle_request
+        do_POST = handle_request
+
+    return StubHandler
+
+
+def start(engine=None, host="127.0.0.1", port=0):
+    """Serve a StubEngine in a daemon thread, return the server (see `server_port`)."""
+    engine = engine or StubEngine()
+    server = ThreadingHTTPServer((host, port), make_handler(engine))
+    server.daemon_threads = True
+    server.engine = engine
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="fake Voicevox Engine for benchmarks")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50021)
+    parser.add_argument(
+        "--latency",
+        type=str,
+        action="append",
+        default=[],
+        help="<path>=<spec> latency distribution of an endpoint, e.g. "
+        "/synthesis=lognormal:0.05,0.5 or default=const:0.001",
+    )
+    parser.add_argument(
+        "--latency_per_mora",
+        type=float,
+        default=0.0,
+        help="extra seconds of synthesis per mora",
+    )
+    parser.add_argument(
+        "--seconds_per_mora",
+        type=float,
+        default=0.12,
+        help="seconds of audio per mora",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    engine = StubEngine(
+        latency=dict(item.split("=", 1) for item in args.latency),
+        latency_per_mora=args.latency_per_mora,
+        seconds_per_mora=args.seconds_per_mora,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(engine))
+    print(f"stub Voicevox Engine on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,18 @@
+import sys
+from pathlib import Path
+import pytest
+
+# the modules live at the top of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import stub_server  # noqa: E402
+
+
+@pytest.fixture
+def stub():
+    """A fake Voicevox Engine on a free port, see stub_server."""
+    server = stub_server.start()
+    server.base_url = f"http://127.0.0.1:{server.server_port}"
+    yield server
+    server.shutdown()
+    server.server_close()
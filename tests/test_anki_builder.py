@@ -0,0 +1,70 @@
+import json
+import zipfile
+import genanki
+import pytest
+from AnkiBuilder import AnkiBuilder
+
+MODEL = genanki.Model(
+    1607392319,
+    "test model",
+    fields=[{"name": "Front"}, {"name": "Back"}],
+    templates=[{"name": "Card 1", "qfmt": "{{Front}}", "afmt": "{{Back}}"}],
+)
+
+
+@pytest.fixture
+def media(tmp_path):
+    paths = {}
+    for name, content in [("a.mp3", b"aaa"), ("b.mp3", b"bbb"), ("copy_of_a.mp3", b"aaa")]:
+        paths[name] = tmp_path / name
+        paths[name].write_bytes(content)
+    return paths
+
+
+def build(out_file, decks, media):
+    """decks: {deck_id: [word, ...]}, every word refers to the media file of its name."""
+    builder = AnkiBuilder(out_file, MODEL)
+    built = []
+    for deck_id, words in decks.items():
+        if not builder.add_deck(deck_id, f"deck {deck_id}", AnkiBuilder.fingerprint(words)):
+            continue
+        built.append(deck_id)
+        for word in words:
+            builder.add_note(deck_id, [word, f"[sound:{word}.mp3]"], media=[media[f"{word}.mp3"]])
+    return built, builder.write()
+
+
+def stored_media(out_file):
+    with zipfile.ZipFile(out_file) as z:
+        return json.loads(z.read("media"))
+
+
+def test_unchanged_decks_are_not_rebuilt(tmp_path, media):
+    out_file = tmp_path / "cards.apkg"
+    decks = {1: ["a"], 2: ["b"]}
+    assert build(out_file, decks, media) == ([1, 2], True)
+    mtime = out_file.stat().st_mtime_ns
+
+    assert build(out_file, decks, media) == ([], False)
+    assert out_file.stat().st_mtime_ns == mtime
+
+    # only the changed deck is built again, the other one is restored
+    assert build(out_file, {1: ["a"], 2: ["b", "a"]}, media) == ([2], True)
+    assert sorted(stored_media(out_file).values()) == ["a.mp3", "b.mp3"]
+
+
+def test_missing_media_rebuild_the_deck(tmp_path, media):
+    out_file = tmp_path / "cards.apkg"
+    build(out_file, {1: ["a"], 2: ["b"]}, media)
+    media["b.mp3"].unlink()
+    builder = AnkiBuilder(out_file, MODEL)
+    assert not builder.add_deck(1, "deck 1", AnkiBuilder.fingerprint(["a"]))
+    assert builder.add_deck(2, "deck 2", AnkiBuilder.fingerprint(["b"]))
+
+
+def test_identical_media_are_stored_once(tmp_path, media):
+    out_file = tmp_path / "cards.apkg"
+    build(out_file, {1: ["a", "copy_of_a", "b"]}, media)
+    assert sorted(stored_media(out_file).values()) == ["a.mp3", "b.mp3"]
+    with zipfile.ZipFile(out_file) as z:
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in z.infolist() if info.filename.isdigit())
@@ -0,0 +1,62 @@
+import time
+import threading
+from pathlib import Path
+import pytest
+import stub_server
+from Compressor import Compressor
+from CompressorPool import CompressorPool
+
+
+class GatedCompressor(Compressor):
+    """Holds a job back until the file `<out_file>.go` exists."""
+
+    def compress(self, *args, out_file=None, **kwargs):
+        gate = Path(f"{out_file}.go")
+        if Path(out_file).name.startswith("gated"):
+            while not gate.is_file():
+                time.sleep(0.01)
+        return super().compress(*args, out_file=out_file, **kwargs)
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with CompressorPool(GatedCompressor(), workers=1, max_pending=1) as pool:
+        yield pool
+
+
+@pytest.fixture(scope="module")
+def wav():
+    return stub_server.StubEngine().wav(5)
+
+
+def test_compresses_wav_bytes(pool, wav, tmp_path):
+    out_file = tmp_path / "a.mp3"
+    assert pool.submit(data=wav, out_file=out_file).result(30) == str(out_file)
+    assert out_file.stat().st_size > 0
+
+
+def test_worker_errors_are_raised_from_the_future(pool, wav, tmp_path):
+    future = pool.submit(data=wav, out_file=tmp_path / "missing" / "a.mp3")
+    with pytest.raises(AssertionError, match="is not found"):
+        future.result(30)
+    future = pool.submit(data=b"not a wav", out_file=tmp_path / "b.mp3")
+    with pytest.raises(Exception):
+        future.result(30)
+    # the failed jobs released their slots
+    assert pool.submit(data=wav, out_file=tmp_path / "c.mp3").result(30)
+
+
+def test_submit_blocks_while_max_pending_jobs_run(pool, wav, tmp_path):
+    first = pool.submit(data=wav, out_file=tmp_path / "gated.mp3")
+    second = []
+    thread = threading.Thread(
+        target=lambda: second.append(pool.submit(data=wav, out_file=tmp_path / "second.mp3"))
+    )
+    thread.start()
+    thread.join(0.5)
+    assert thread.is_alive() and not second
+
+    (tmp_path / "gated.mp3.go").touch()
+    assert first.result(30) == str(tmp_path / "gated.mp3")
+    thread.join(30)
+    assert second[0].result(30) == str(tmp_path / "second.mp3")
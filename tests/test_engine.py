@@ -0,0 +1,29 @@
+import io
+import wave
+from VoicevoxEngine import VoicevoxEngine
+
+
+def frames(wav):
+    with wave.open(io.BytesIO(wav), "rb") as w:
+        return w.getnframes()
+
+
+def test_tts_batch_keeps_the_order_of_the_texts(stub):
+    engine = VoicevoxEngine(stub.base_url)
+    # the stub's wavs grow with the mora count, so every text has its own length
+    texts = ["ああああ", "あ", "あああああ", "ああ", "あああ"]
+    wavs = engine.tts_batch(13, texts)
+    expected = [frames(stub.engine.wav(len(text))) for text in texts]
+    assert [frames(wav) for wav in wavs] == expected
+    assert stub.engine.counts["/multi_synthesis"] == 1
+    assert "/synthesis" not in stub.engine.counts
+
+
+def test_tts_batch_splits_large_batches_in_order(stub):
+    engine = VoicevoxEngine(stub.base_url)
+    engine.batch_max_items = 8
+    texts = ["あ" * (i % 7 + 1) for i in range(40)]
+    wavs = engine.tts_batch(13, texts)
+    expected = [frames(stub.engine.wav(len(text))) for text in texts]
+    assert [frames(wav) for wav in wavs] == expected
+    assert stub.engine.counts["/multi_synthesis"] == 5
@@ -0,0 +1,68 @@
+import json
+import sys
+import pytest
+import main
+
+
+@pytest.fixture
+def run(stub, tmp_path, monkeypatch):
+    """Run main.py on `sentences` against the stub, return the output entries."""
+    monkeypatch.chdir(tmp_path)
+
+    def run(sentences, *extra):
+        with open("input.jsonl", "w", encoding="utf-8") as f:
+            for sentence in sentences:
+                f.write(json.dumps({"sentence": sentence}, ensure_ascii=False) + "\n")
+        monkeypatch.setattr(
+            sys,
+            "argv",
+            ["main.py", "--base_url", stub.base_url, "--speaker_ids", "13", "23", *extra],
+        )
+        main.main(main.get_args())
+        with open("output.jsonl", "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    return run
+
+
+def test_duplicate_sentences_share_one_synthesis(run, stub, tmp_path):
+    sentences = ["テスト", "ＡＢＣ", " テスト", "ABC", "別の文"]
+    entries = run(sentences)
+    # 3 unique sentences for 2 speakers
+    assert stub.engine.counts["/audio_query"] == 6
+    assert stub.engine.counts["/synthesis"] == 6
+    assert [entry["sentence"] for entry in entries] == sentences
+    assert entries[0]["audio_files"] == entries[2]["audio_files"]
+    assert entries[1]["audio_files"] == entries[3]["audio_files"]
+    assert len({path for entry in entries for path in entry["audio_files"]}) == 6
+    assert all((tmp_path / path).is_file() for entry in entries for path in entry["audio_files"])
+    assert not any("_processing_error" in entry for entry in entries)
+
+
+def test_stream_mode_fans_out_duplicates(run, stub):
+    entries = run(["あ", "い", "あ", "い", "あ"], "--stream")
+    assert stub.engine.counts["/synthesis"] == 4
+    # stream mode appends entries as they finish
+    assert sorted(entry["sentence"] for entry in entries) == ["あ", "あ", "あ", "い", "い"]
+
+
+def test_resume_skips_journaled_entries(run, stub, tmp_path):
+    sentences = [f"文{i}" for i in range(6)]
+    first = run(sentences)
+    assert stub.engine.counts["/synthesis"] == 12
+
+    # an interrupted run journaled the first half only
+    journal = tmp_path / "output.jsonl.journal"
+    keys = journal.read_text(encoding="utf-8").split()
+    assert len(keys) == 6
+    journal.write_text("".join(f"{key}\n" for key in keys[:3]), encoding="utf-8")
+    for entry in first:
+        if entry["sentence"] in sentences[3:]:
+            for path in entry["audio_files"]:
+                (tmp_path / path).unlink()
+
+    second = run(sentences, "--resume")
+    assert stub.engine.counts["/synthesis"] == 12 + 6
+    assert second == first
+    assert all((tmp_path / path).is_file() for entry in second for path in entry["audio_files"])
+    assert len(journal.read_text(encoding="utf-8").split()) == 6
@@ -0,0 +1,59 @@
+from Pipeline import TtsJob, TtsPipeline
+from VoicevoxEngine import VoicevoxEngine
+
+
+class FailingEngine:
+    """Forwards to an engine, make_query fails for one text."""
+
+    def __init__(self, engine, bad_text):
+        self.engine = engine
+        self.bad_text = bad_text
+
+    def make_query(self, speaker, text, params_hook):
+        if text == self.bad_text:
+            raise ValueError(f"bad text: {text}")
+        return self.engine.make_query(speaker, text, params_hook)
+
+    def synthesis(self, speaker, query):
+        return self.engine.synthesis(speaker, query)
+
+
+def run(engine, texts, **kwargs):
+    written = []
+    pipeline = TtsPipeline(engine, lambda job: written.append(job.text), **kwargs)
+    jobs = [TtsJob(speaker=13, text=text, tag=idx) for idx, text in enumerate(texts)]
+    return list(pipeline.run(jobs)), written
+
+
+def test_every_job_is_yielded(stub):
+    texts = [f"テスト{i}" for i in range(20)]
+    done, written = run(VoicevoxEngine(stub.base_url), texts, queue_size=2)
+    assert sorted(job.tag for job in done) == list(range(20))
+    assert all(job.error is None for job in done)
+    assert sorted(written) == sorted(texts)
+    assert stub.engine.counts["/synthesis"] == 20
+
+
+def test_single_workers_keep_the_input_order(stub):
+    texts = [f"テスト{i}" for i in range(10)]
+    done, written = run(
+        VoicevoxEngine(stub.base_url),
+        texts,
+        query_workers=1,
+        synthesis_workers=1,
+        writer_workers=1,
+    )
+    assert [job.tag for job in done] == list(range(10))
+    assert written == texts
+
+
+def test_a_failing_job_does_not_stop_the_others(stub):
+    texts = ["あ", "いい", "ううう"]
+    done, written = run(FailingEngine(VoicevoxEngine(stub.base_url), "いい"), texts)
+    errors = {job.text: job.error for job in done}
+    assert isinstance(errors["いい"], ValueError)
+    assert errors["あ"] is None and errors["ううう"] is None
+    # failed jobs skip the later stages
+    assert sorted(written) == ["あ", "ううう"]
+    assert stub.engine.counts["/synthesis"] == 2
+
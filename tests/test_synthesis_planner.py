@@ -0,0 +1,26 @@
+from SynthesisPlanner import SynthesisPlanner, normalize_sentence
+
+
+def test_duplicates_fan_out_to_every_target():
+    planner = SynthesisPlanner(normalize=normalize_sentence)
+    job, status = planner.add("テスト", 13, target="a")
+    assert status == "new"
+    assert planner.add(" テスト", 13, target="b") == (job, "queued")
+    assert planner.add("テスト", 23, target="c")[1] == "new"
+    assert planner.finish(job) == ["a", "b"]
+    # requests after the job finished are not kept
+    assert planner.add("テスト", 13, target="d") == (job, "done")
+    assert planner.stats() == {"requested": 4, "unique": 2, "saved": 2}
+
+
+def test_compact_planner_keeps_errors_and_bounds_finished_jobs():
+    planner = SynthesisPlanner(compact=True, max_finished=2)
+    for text in ["a", "b", "c"]:
+        job, _ = planner.add(text, 1)
+        planner.finish(job, ValueError(text) if text == "b" else None)
+    assert list(planner) == []
+    assert len(planner) == 2
+    job, status = planner.add("b", 1)
+    assert status == "done" and job.error == "b"
+    # "a" fell out of the window and is synthesized again
+    assert planner.add("a", 1)[1] == "new"